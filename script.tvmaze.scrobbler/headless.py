@@ -0,0 +1,189 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Headless entry point
+
+Runs the sync engine from a regular Python process and drives Kodi
+over JSON-RPC HTTP API. Kodi web server must be enabled.
+Requires requests, six and python-dateutil packages
+and websockets package for "listen" command. Kodi GUI modules,
+pyxbmct and pyqrcode are not needed because the addon authorization
+dialog is not available: TVmaze credentials are passed as described below.
+
+Secrets are not accepted as command line arguments that are visible
+to other users: TVmaze API key and Kodi web server password are read
+from files or from TVMAZE_APIKEY and KODI_PASSWORD environment variables
+and are not stored in the settings file.
+
+Example::
+
+    TVMAZE_APIKEY=XXXX python headless.py --url http://192.168.1.10:8080/jsonrpc \\
+        --tvmaze-user johndoe sync
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import argparse
+import io
+import logging
+import os
+
+from libs import headless_runtime
+
+DEFAULT_PROFILE_DIR = os.path.join(os.path.expanduser('~'), '.tvmaze-scrobbler')
+TVMAZE_APIKEY_ENV = 'TVMAZE_APIKEY'
+KODI_PASSWORD_ENV = 'KODI_PASSWORD'
+
+
+def parse_arguments(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Sync Kodi medialibrary with TVmaze')
+    parser.add_argument('command', choices=['sync', 'pull', 'listen', 'daemon'],
+                        help='"sync" - sync all episodes, '
+                             '"pull" - pull watched episodes from TVmaze, '
+                             '"listen" - push library changes to TVmaze as they happen, '
+                             '"daemon" - periodically pull watched episodes to several hosts')
+    parser.add_argument('--url', default='http://localhost:8080/jsonrpc',
+                        help='Kodi JSON-RPC URL (default: %(default)s)')
+    parser.add_argument('--ws-url', default='ws://localhost:9090/jsonrpc',
+                        help='Kodi WebSocket URL for "listen" command (default: %(default)s)')
+    parser.add_argument('--hosts-config',
+                        help='JSON file with Kodi hosts for "daemon" command')
+    parser.add_argument('--interval-hours', type=float, default=1.0,
+                        help='pull interval for "daemon" command (default: %(default)s)')
+    parser.add_argument('--kodi-user', help='Kodi web server username')
+    parser.add_argument('--kodi-password-file',
+                        help='file with Kodi web server password '
+                             '(default: {} environment variable)'.format(KODI_PASSWORD_ENV))
+    parser.add_argument('--profile-dir', default=DEFAULT_PROFILE_DIR,
+                        help='directory for settings and databases (default: %(default)s)')
+    parser.add_argument('--tvmaze-user', help='TVmaze username')
+    parser.add_argument('--tvmaze-apikey-file',
+                        help='file with TVmaze API key '
+                             '(default: {} environment variable)'.format(TVMAZE_APIKEY_ENV))
+    parser.add_argument('--pool-size', type=int, default=4,
+                        help='max number of HTTP connections to Kodi (default: %(default)s)')
+    parser.add_argument('--verbose', action='store_true', help='enable debug logging')
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument('--record', metavar='CASSETTE',
+                                help='record TVmaze and Kodi traffic to a cassette file')
+    cassette_group.add_argument('--replay', metavar='CASSETTE',
+                                help='replay TVmaze and Kodi traffic from a cassette file')
+    parser.add_argument('--replay-latency', type=float, default=0.0,
+                        help='simulated latency of replayed responses in seconds '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.command == 'daemon' and not args.hosts_config:
+        parser.error('--hosts-config is required for "daemon" command')
+    if args.command == 'daemon' and (args.record or args.replay):
+        parser.error('Cassettes are not supported for "daemon" command')
+    return args
+
+
+def read_secret(env_var, file_path=None):
+    """Read a secret from a file or from an environment variable"""
+    if file_path:
+        with io.open(file_path, 'r', encoding='utf-8') as fo:
+            return fo.read().strip()
+    return os.environ.get(env_var) or None
+
+
+def use_cassette(args):
+    """Record or replay TVmaze and Kodi traffic"""
+    # pylint: disable=import-outside-toplevel
+    from libs import medialibrary_api as medialib, tvmaze_api as tvmaze
+    from libs.cassettes import Cassette, CassetteAdapter, CassetteTransport
+
+    cassette = Cassette(args.record or args.replay, args.replay_latency)
+    if args.replay:
+        cassette.load()
+    adapter = CassetteAdapter(cassette, replay=bool(args.replay))
+    tvmaze.SESSION.mount('http://', adapter)
+    tvmaze.SESSION.mount('https://', adapter)
+    medialib.set_transport(
+        CassetteTransport(cassette, None if args.replay else medialib.TRANSPORT))
+    return cassette
+
+
+def listen(ws_url):
+    """Handle Kodi medialibrary notifications until interrupted"""
+    # pylint: disable=import-outside-toplevel
+    import asyncio
+    from libs.kodi_monitor import KodiMonitor
+    from libs.websocket_listener import NotificationListener
+
+    listener = NotificationListener(ws_url, KodiMonitor())
+    try:
+        asyncio.run(listener.run())
+    except KeyboardInterrupt:
+        headless_runtime.request_abort()
+
+
+def run_daemon(hosts_config, base_interval):
+    """Sync several Kodi hosts until interrupted"""
+    # pylint: disable=import-outside-toplevel
+    from libs.kodi_compat import xbmc
+    from libs import multi_host
+
+    hosts = multi_host.load_hosts(hosts_config)
+    try:
+        multi_host.run_daemon(hosts, base_interval, xbmc.Monitor())
+    except KeyboardInterrupt:
+        headless_runtime.request_abort()
+
+
+def main(argv=None):
+    """Run a sync command"""
+    args = parse_arguments(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    settings_overrides = {}
+    tvmaze_apikey = read_secret(TVMAZE_APIKEY_ENV, args.tvmaze_apikey_file)
+    if args.tvmaze_user and tvmaze_apikey:
+        settings_overrides = {'username': args.tvmaze_user, 'apikey': tvmaze_apikey}
+    elif args.tvmaze_user:
+        logging.warning('TVmaze API key is not set, stored credentials are used')
+    headless_runtime.install(args.profile_dir, settings_overrides)
+    # Kodi API modules must be installed before addon modules are imported
+    # pylint: disable=import-outside-toplevel
+    from libs import medialibrary_api as medialib, scrobbling_service as scrobbler
+    from libs.exception_logger import log_exception
+
+    kodi_auth = None
+    if args.kodi_user:
+        kodi_auth = (args.kodi_user,
+                     read_secret(KODI_PASSWORD_ENV, args.kodi_password_file) or '')
+    medialib.set_transport(medialib.HttpJsonRpcTransport(
+        args.url, kodi_auth, pool_size=args.pool_size))
+    cassette = use_cassette(args) if args.record or args.replay else None
+    try:
+        with log_exception():
+            if args.command == 'sync':
+                scrobbler.sync_all_episodes()
+            elif args.command == 'pull':
+                scrobbler.pull_watched_episodes()
+            elif args.command == 'listen':
+                listen(args.ws_url)
+            else:
+                run_daemon(args.hosts_config, int(args.interval_hours * 3600))
+    finally:
+        if args.record:
+            cassette.save()
+
+
+if __name__ == '__main__':
+    main()
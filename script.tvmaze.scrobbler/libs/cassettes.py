@@ -0,0 +1,266 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Record and replay TVmaze API and Kodi JSON-RPC traffic
+
+In recording mode request/response pairs are captured to a cassette
+JSON file with credentials removed. In replay mode responses are served
+from the cassette with simulated latency, so syncs can be run and
+benchmarked against real data without TVmaze and Kodi.
+
+Times in request keys are normalized, so a cassette recorded in one
+timezone can be replayed in another one: TVmaze ``marked_at`` timestamps
+are stored as Kodi local time strings that they are converted from
+and Kodi ``lastplayed`` strings are stored as TVmaze timestamps
+that they are converted from.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import io
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+import requests
+import six
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from .exception_logger import SENSITIVE_NAME_RE, SENSITIVE_QUERY_VALUE_RE
+from .kodi_service import logger
+from .time_utils import time_string_to_timestamp, timestamp_to_time_string
+
+try:
+    # pylint: disable=unused-import
+    from typing import Text, Dict, List, Any, Optional, Deque, Tuple
+except ImportError:
+    pass
+
+CASSETTE_VERSION = 2
+REDACTED = '<redacted>'
+
+
+class CassetteError(Exception):
+    pass
+
+
+def _redact(data):
+    # type: (Any) -> Any
+    if isinstance(data, dict):
+        return {key: REDACTED if SENSITIVE_NAME_RE.search(key) else _redact(value)
+                for key, value in data.items()}
+    if isinstance(data, list):
+        return [_redact(item) for item in data]
+    return data
+
+
+def _normalize_time(key, value):
+    # type: (Text, Any) -> Any
+    try:
+        if key == 'marked_at' and isinstance(value, six.integer_types):
+            return timestamp_to_time_string(value)
+        if key == 'lastplayed' and value:
+            return time_string_to_timestamp(value)
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
+def _normalize_times(data):
+    # type: (Any) -> Any
+    if isinstance(data, dict):
+        return {key: _normalize_times(_normalize_time(key, value))
+                for key, value in data.items()}
+    if isinstance(data, list):
+        return [_normalize_times(item) for item in data]
+    return data
+
+
+def _sanitize_body(body, is_request=False):
+    # type: (Optional[Text], bool) -> Optional[Text]
+    """
+    Remove credentials from a JSON body and format it in a stable way
+
+    :param body: request or response body
+    :param is_request: normalize times in a request body that is used as a key
+    """
+    if not body:
+        return body
+    try:
+        data = _redact(json.loads(body))
+    except ValueError:
+        return body
+    if is_request:
+        data = _normalize_times(data)
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+class Cassette(object):
+    """
+    The list of recorded interactions
+
+    Interactions are matched by kind ("tvmaze" or "jsonrpc") and sanitized
+    request. Repeated identical requests are answered in the recorded order
+    and the last response is reused when recorded responses are exhausted.
+    Requests that have not been recorded are collected in :attr:`missed`.
+    """
+
+    def __init__(self, path, latency=0.0):
+        # type: (Text, float) -> None
+        """
+        :param path: cassette file path
+        :param latency: simulated latency for replayed responses in seconds
+        """
+        self.path = path
+        self.latency = latency
+        self._interactions = []  # type: List[Dict[Text, Any]]
+        self._responses = defaultdict(deque)  # type: Dict[Tuple[Text, Text], Deque[Any]]
+        self._last_responses = {}  # type: Dict[Tuple[Text, Text], Any]
+        self._lock = threading.Lock()
+        self.missed = []  # type: List[Tuple[Text, Text]]
+
+    def load(self):
+        # type: () -> None
+        with io.open(self.path, 'r', encoding='utf-8') as fo:
+            cassette = json.load(fo)
+        if cassette.get('version') != CASSETTE_VERSION:
+            raise CassetteError('Unsupported cassette version: {}'.format(cassette.get('version')))
+        self._interactions = cassette['interactions']
+        for interaction in self._interactions:
+            key = (interaction['kind'], interaction['request'])
+            self._responses[key].append(interaction['response'])
+        logger.info('Loaded {} interactions from {}'.format(len(self._interactions), self.path))
+
+    def save(self):
+        # type: () -> None
+        with self._lock:
+            cassette = {'version': CASSETTE_VERSION, 'interactions': self._interactions}
+            with io.open(self.path, 'w', encoding='utf-8') as fo:
+                fo.write(json.dumps(cassette, indent=1, ensure_ascii=False))
+        logger.info('Saved {} interactions to {}'.format(len(self._interactions), self.path))
+
+    def record(self, kind, request, response):
+        # type: (Text, Text, Any) -> None
+        with self._lock:
+            self._interactions.append({'kind': kind, 'request': request, 'response': response})
+
+    def play(self, kind, request):
+        # type: (Text, Text) -> Any
+        """
+        Get a recorded response
+
+        :raises CassetteError: if the request has not been recorded
+        """
+        key = (kind, request)
+        with self._lock:
+            responses = self._responses.get(key)
+            if responses:
+                self._last_responses[key] = responses.popleft()
+            if key not in self._last_responses:
+                self.missed.append(key)
+                raise CassetteError('Request is not recorded: {} {}'.format(kind, request))
+            response = self._last_responses[key]
+        if self.latency:
+            time.sleep(self.latency)
+        return response
+
+    def get_unplayed(self):
+        # type: () -> List[Tuple[Text, Text]]
+        """Get recorded requests that have not been replayed"""
+        with self._lock:
+            return [key for key, responses in self._responses.items() for _ in responses]
+
+
+def _get_request_key(request):
+    # type: (requests.PreparedRequest) -> Text
+    body = request.body
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    url = SENSITIVE_QUERY_VALUE_RE.sub(r'\1{}'.format(REDACTED), request.url)
+    return '{} {} {}'.format(request.method, url, _sanitize_body(body, is_request=True) or '')
+
+
+class CassetteAdapter(BaseAdapter):
+    """
+    Requests transport adapter that records or replays TVmaze API traffic
+
+    Mount it to :data:`tvmaze_api.SESSION` to capture all TVmaze API calls.
+    Only status codes, content type and bodies are stored, request headers
+    including credentials are not.
+    """
+
+    def __init__(self, cassette, replay=False):
+        # type: (Cassette, bool) -> None
+        super(CassetteAdapter, self).__init__()
+        self._cassette = cassette
+        self._replay = replay
+        self._http_adapter = None if replay else HTTPAdapter()
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        # type: (requests.PreparedRequest, **Any) -> requests.Response
+        key = _get_request_key(request)
+        if not self._replay:
+            response = self._http_adapter.send(request, **kwargs)
+            self._cassette.record('tvmaze', key, {
+                'status_code': response.status_code,
+                'content_type': response.headers.get('Content-Type', ''),
+                'body': _sanitize_body(response.text),
+            })
+            return response
+        recorded = self._cassette.play('tvmaze', key)
+        response = requests.Response()
+        response.status_code = recorded['status_code']
+        response.headers = CaseInsensitiveDict({'Content-Type': recorded['content_type']})
+        # pylint: disable=protected-access
+        response._content = (recorded['body'] or '').encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        if self._http_adapter is not None:
+            self._http_adapter.close()
+
+
+class CassetteTransport(object):
+    """
+    JSON-RPC transport that records or replays Kodi JSON-RPC traffic
+
+    In recording mode requests are passed to the wrapped transport.
+    Requests and responses are stored with credentials removed.
+    """
+
+    def __init__(self, cassette, transport=None):
+        # type: (Cassette, Optional[Any]) -> None
+        """
+        :param cassette: cassette instance
+        :param transport: JSON-RPC transport for recording or ``None`` for replay
+        """
+        self._cassette = cassette
+        self._transport = transport
+
+    def execute(self, request):
+        # type: (Text) -> Text
+        key = _sanitize_body(request, is_request=True)
+        if self._transport is None:
+            return self._cassette.play('jsonrpc', key)
+        response = self._transport.execute(request)
+        self._cassette.record('jsonrpc', key, _sanitize_body(response))
+        return response
@@ -0,0 +1,125 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# pylint: disable=missing-docstring
+"""
+The local catalog of TVmaze episodes
+
+It is used to resolve season/episode numbering of Kodi episodes
+to TVmaze episode IDs without extra API calls.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from .sqlite_db import SqliteDb, get_db_path
+
+try:
+    from typing import Optional, List, Dict, Any, Text, Tuple  # pylint: disable=unused-import
+except ImportError:
+    pass
+
+# How often to check if a catalogued show has been updated on TVmaze
+CHECK_INTERVAL = 24 * 3600
+
+
+class EpisodeCatalogDb(SqliteDb):
+    DB = get_db_path('episode-catalog.sqlite')
+    SCHEMA = (
+        """
+            CREATE TABLE IF NOT EXISTS catalog_shows(
+                show_id INTEGER PRIMARY KEY,
+                updated INTEGER NOT NULL,
+                checked_at INTEGER NOT NULL
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS catalog_episodes(
+                episode_id INTEGER PRIMARY KEY,
+                show_id INTEGER NOT NULL,
+                season INTEGER,
+                number INTEGER,
+                airdate TEXT,
+                type TEXT
+            )
+        """,
+        """
+            CREATE INDEX IF NOT EXISTS catalog_episodes_show_id
+            ON catalog_episodes(show_id)
+        """,
+    )
+
+    def get_show_state(self, show_id):
+        # type: (int) -> Optional[Tuple[int, int]]
+        """
+        Get the state of a catalogued show
+
+        :return: (TVmaze "updated" timestamp, last check timestamp) tuple
+            or ``None`` if the show is not in the catalog
+        """
+        self._cursor.execute("""
+            SELECT updated, checked_at
+            FROM catalog_shows
+            WHERE show_id = ?
+        """, [show_id])
+        return self._cursor.fetchone()
+
+    def set_checked(self, show_id, checked_at):
+        # type: (int, int) -> None
+        self._cursor.execute("""
+            UPDATE catalog_shows
+            SET checked_at = ?
+            WHERE show_id = ?
+        """, [checked_at, show_id])
+
+    def store_show(self, show_id, updated, checked_at, episodes):
+        # type: (int, int, int, List[Dict[Text, Any]]) -> None
+        """
+        Replace catalogued episodes of a show
+
+        :param show_id: show ID on TVmaze
+        :param updated: TVmaze "updated" timestamp of the show
+        :param checked_at: current timestamp
+        :param episodes: the list of show episodes from TVmaze
+        """
+        self._cursor.execute('DELETE FROM catalog_episodes WHERE show_id = ?', [show_id])
+        self._cursor.executemany("""
+            INSERT OR REPLACE INTO catalog_episodes
+            (episode_id, show_id, season, number, airdate, type)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(episode['id'], show_id, episode.get('season'), episode.get('number'),
+               episode.get('airdate'), episode.get('type')) for episode in episodes])
+        self._cursor.execute("""
+            INSERT OR REPLACE INTO catalog_shows
+            (show_id, updated, checked_at)
+            VALUES (?, ?, ?)
+        """, [show_id, updated, checked_at])
+
+    def get_episode_ids_by_numbering(self, show_id):
+        # type: (int) -> Dict[Tuple[int, int], int]
+        """
+        Get the mapping of (season, number) to TVmaze episode IDs for a show
+
+        Insignificant specials are mapped to season 0 the same way as in Kodi.
+        """
+        self._cursor.execute("""
+            SELECT episode_id, season, number, type
+            FROM catalog_episodes
+            WHERE show_id = ? AND number IS NOT NULL
+        """, [show_id])
+        mapping = {}
+        for episode_id, season, number, type_ in self._cursor.fetchall():
+            if type_ == 'insignificant_special':
+                season = 0
+            mapping[(season, number)] = episode_id
+        return mapping
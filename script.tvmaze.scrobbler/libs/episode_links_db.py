@@ -0,0 +1,87 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# pylint: disable=missing-docstring
+"""
+The database of links between TVmaze episodes and Kodi episodes
+
+It is used to find a Kodi episode for a TVmaze episode with a single indexed lookup.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from .sqlite_db import SqliteDb, get_db_path
+
+try:
+    from typing import Iterable, Dict, Tuple  # pylint: disable=unused-import
+except ImportError:
+    pass
+
+
+class EpisodeLinksDb(SqliteDb):
+    DB = get_db_path('episode-links.sqlite')
+    SCHEMA = (
+        """
+            CREATE TABLE IF NOT EXISTS episode_links(
+                tvmaze_episode_id INTEGER PRIMARY KEY,
+                kodi_episode_id INTEGER NOT NULL UNIQUE,
+                kodi_tvshow_id INTEGER NOT NULL
+            )
+        """,
+        """
+            CREATE INDEX IF NOT EXISTS episode_links_kodi_tvshow_id
+            ON episode_links(kodi_tvshow_id)
+        """,
+    )
+
+    def link_episodes(self, links):
+        # type: (Iterable[Tuple[int, int, int]]) -> None
+        """
+        Store links between episodes
+
+        :param links: (TVmaze episode ID, Kodi episode ID, Kodi TV show ID) tuples
+        """
+        self._cursor.executemany("""
+            INSERT OR REPLACE INTO episode_links
+            (tvmaze_episode_id, kodi_episode_id, kodi_tvshow_id)
+            VALUES (?, ?, ?)
+        """, links)
+
+    def get_kodi_episode_ids(self, kodi_tvshow_id):
+        # type: (int) -> Dict[int, int]
+        """
+        Get linked episodes of a Kodi TV show
+
+        :return: the mapping of TVmaze episode IDs to Kodi episode IDs
+        """
+        self._cursor.execute("""
+            SELECT tvmaze_episode_id, kodi_episode_id
+            FROM episode_links
+            WHERE kodi_tvshow_id = ?
+        """, [kodi_tvshow_id])
+        return dict(self._cursor.fetchall())
+
+    def remove_episode(self, kodi_episode_id):
+        # type: (int) -> None
+        self._cursor.execute('DELETE FROM episode_links WHERE kodi_episode_id = ?',
+                             [kodi_episode_id])
+
+    def remove_tvshow(self, kodi_tvshow_id):
+        # type: (int) -> None
+        self._cursor.execute('DELETE FROM episode_links WHERE kodi_tvshow_id = ?',
+                             [kodi_tvshow_id])
+
+    def clear(self):
+        # type: () -> None
+        self._cursor.execute('DELETE FROM episode_links')
@@ -0,0 +1,435 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Push watched statuses of Kodi episodes to TVmaze
+
+Episodes that cannot be pushed while TVmaze API is unavailable
+are deferred to the library change journal.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import threading
+import time
+from collections import defaultdict, namedtuple
+from pprint import pformat
+
+import six
+
+from . import gui, medialibrary_api as medialib, tvmaze_api as tvmaze, kodi_service as kodi
+from .episode_catalog_db import CHECK_INTERVAL as CATALOG_CHECK_INTERVAL, EpisodeCatalogDb
+from .episode_links_db import EpisodeLinksDb
+from .episode_records import EpisodeRecord, to_scrobble_payload
+from .kodi_service import logger
+from .library_journal_db import DeferredEpisodesDb, LibraryJournalDb
+from .reconciliation import merge_episode_records
+from .time_utils import time_strings_to_timestamps
+from .work_queue import yield_to_higher_priority
+
+try:
+    # pylint: disable=unused-import
+    from typing import Text, Dict, Any, List, Tuple, Optional, Iterable, Type
+except ImportError:
+    pass
+
+_ = kodi.GETTEXT
+
+SUPPORTED_IDS = ('tvmaze', 'tvdb', 'imdb')
+CHANGED_EPISODES_BATCH_SIZE = 200
+
+# Set when episodes have been deferred because TVmaze API is unavailable.
+# The flag is stored in addon settings to push deferred episodes after restart.
+_DEFERRED_PUSH = threading.Event()
+if kodi.ADDON.getSettingBool('deferred_push'):
+    _DEFERRED_PUSH.set()
+
+UniqueId = namedtuple('UniqueId', ['show_id', 'provider'])  # pylint: disable=invalid-name
+
+
+def handle_authentication_error():
+    # type: () -> None
+    tvmaze.clear_credentials()
+    gui.DIALOG.notification(kodi.ADDON_NAME,
+                            _('Authentication failed. You need to authorize the addon.'),
+                            icon='error')
+
+
+def _get_unique_id(uniqueid_dict):
+    # type: (Dict[Text, Text]) -> Optional[UniqueId]
+    """
+    Get a show ID in one of the supported online databases
+
+    :param uniqueid_dict: uniqueid dict from Kodi JSON-RPC API
+    :return: a named tuple of unique ID and online data provider
+    """
+    for provider in SUPPORTED_IDS:
+        show_id = uniqueid_dict.get(provider)
+        if show_id is not None:
+            if provider == 'tvdb':
+                provider = 'thetvdb'
+            return UniqueId(show_id, provider)
+    return None
+
+
+def create_episode_records(kodi_episode_list):
+    # type: (List[Dict[Text, Any]]) -> List[EpisodeRecord]
+    """Convert Kodi episodes to compact episode records"""
+    now = int(time.time())
+    marked_at_strings = [episode.get('lastplayed') or episode.get('dateadded') or ''
+                         for episode in kodi_episode_list]
+    marked_at_list = time_strings_to_timestamps(string for string in marked_at_strings if string)
+    marked_at_iter = iter(marked_at_list)
+    return [
+        EpisodeRecord.from_kodi_episode(episode,
+                                        next(marked_at_iter) if marked_at_string else now)
+        for episode, marked_at_string in zip(kodi_episode_list, marked_at_strings)
+    ]
+
+
+def prepare_episode_lists(kodi_episode_list):
+    # type: (List[Dict[Text, Any]]) -> Tuple[List[EpisodeRecord], List[EpisodeRecord]]
+    """
+    Convert Kodi episodes to compact episode records
+
+    :param kodi_episode_list: the list of episode infos from Kodi JSON-RPC API
+    :return: (episodes with TVmaze IDs, episodes with season/episode numbering) tuple
+    """
+    episodes_by_id = []
+    episodes_by_numbering = []
+    for record in create_episode_records(kodi_episode_list):
+        if record.tvmaze_id is not None:
+            episodes_by_id.append(record)
+        elif record.has_numbering:
+            episodes_by_numbering.append(record)
+        else:
+            logger.error('Unable to scrobble the episode: {}'.format(record))
+    return episodes_by_id, episodes_by_numbering
+
+
+def load_episode_catalog(tvmaze_id, refresh=True):
+    # type: (int, bool) -> Dict[Tuple[int, int], int]
+    """
+    Get the mapping of (season, number) to TVmaze episode IDs for a TV show
+
+    The local episode catalog is refreshed only if the show
+    has been updated on TVmaze since it has been catalogued.
+
+    :param tvmaze_id: TVmaze show ID
+    :param refresh: refresh the catalog from TVmaze if needed
+        (otherwise only the locally stored catalog is used).
+    """
+    now = int(time.time())
+    with EpisodeCatalogDb() as database:
+        state = database.get_show_state(tvmaze_id)
+    if refresh and (state is None or now - state[1] > CATALOG_CHECK_INTERVAL):
+        try:
+            updated = tvmaze.get_show_info(tvmaze_id).get('updated') or 0
+            if state is None or updated != state[0]:
+                episodes = tvmaze.get_show_episodes(tvmaze_id)
+                with EpisodeCatalogDb() as database:
+                    database.store_show(tvmaze_id, updated, now, episodes)
+            else:
+                with EpisodeCatalogDb() as database:
+                    database.set_checked(tvmaze_id, now)
+        except tvmaze.TvMazeApiError as exc:
+            logger.warning('Unable to update episode catalog for show {}: {}'.format(
+                tvmaze_id, exc))
+    with EpisodeCatalogDb() as database:
+        return database.get_episode_ids_by_numbering(tvmaze_id)
+
+
+def _resolve_episode_ids(episodes_by_numbering, tvmaze_id):
+    # type: (List[EpisodeRecord], int) -> Tuple[List[EpisodeRecord], List[EpisodeRecord]]
+    """
+    Resolve TVmaze episode IDs for episodes with season/episode numbering
+
+    Only the locally stored catalog is used, so pushing episodes
+    does not cost extra TVmaze API calls. The catalog is filled
+    by :class:`scrobbling_service.EpisodeIdBackfill`.
+
+    :return: (resolved episodes, unresolved episodes) tuple
+    """
+    catalog = load_episode_catalog(tvmaze_id, refresh=False)
+    resolved = []
+    unresolved = []
+    for record in episodes_by_numbering:
+        episode_id = catalog.get((record.season, record.episode))
+        if episode_id is not None:
+            record.tvmaze_id = episode_id
+            resolved.append(record)
+        else:
+            unresolved.append(record)
+    return resolved, unresolved
+
+
+def push_episode_records(episodes_by_id, episodes_by_numbering, tvmaze_id):
+    # type: (List[EpisodeRecord], List[EpisodeRecord], int) -> None
+    """
+    Push prepared episode records to TVmaze
+
+    Episodes with season/episode numbering are resolved to TVmaze IDs
+    via the local episode catalog if it is available so that they can be pushed
+    in one batch by IDs. Duplicate episodes from several Kodi shows with the same TVmaze ID
+    are merged before pushing.
+
+    :raises tvmaze.TvMazeApiError: on any API error
+    """
+    if episodes_by_numbering:
+        resolved, episodes_by_numbering = _resolve_episode_ids(episodes_by_numbering, tvmaze_id)
+        episodes_by_id = episodes_by_id + resolved
+    if episodes_by_id:
+        tvmaze.push_episodes_by_id(to_scrobble_payload(merge_episode_records(episodes_by_id)))
+        link_episode_records(episodes_by_id)
+    if episodes_by_numbering:
+        tvmaze.push_episodes_by_show_id(
+            to_scrobble_payload(merge_episode_records(episodes_by_numbering), by_id=False),
+            tvmaze_id)
+
+
+def _load_and_store_tvmaze_id(show_id, provider, kodi_tvshowid):
+    # type: (Text, Text, int) -> Optional[int]
+    try:
+        show_info = tvmaze.get_show_info_by_external_id(show_id, provider)
+    except tvmaze.TvMazeApiError:
+        return None
+    tvmaze_id = show_info['id']
+    medialib.set_show_uniqueid(kodi_tvshowid, tvmaze_id)
+    return tvmaze_id
+
+
+def get_tvmaze_id(kodi_show_info):
+    # type: (Dict[Text, Any]) -> Optional[int]
+    uniqueid_dict = kodi_show_info['uniqueid']
+    unique_id = _get_unique_id(uniqueid_dict)
+    if unique_id is None:
+        return None
+    if unique_id.provider == 'tvmaze':
+        return int(unique_id.show_id)
+    return _load_and_store_tvmaze_id(unique_id.show_id, unique_id.provider,
+                                     kodi_show_info['tvshowid'])
+
+
+def link_episode_records(episode_records):
+    # type: (Iterable[EpisodeRecord]) -> None
+    """Store links between Kodi episodes and TVmaze episodes with known IDs"""
+    links = [(record.tvmaze_id, record.episodeid, record.tvshowid) for record in episode_records
+             if record.tvmaze_id is not None and record.tvshowid is not None]
+    if links:
+        with EpisodeLinksDb() as database:
+            database.link_episodes(links)
+
+
+def _defer_episode_pushes(episode_ids):
+    # type: (List[int]) -> None
+    """Store episodes in the deferred episodes journal to push them when TVmaze is available"""
+    logger.warning('TVmaze API is unavailable, {} episodes will be pushed later'.format(
+        len(episode_ids)))
+    with DeferredEpisodesDb() as database:
+        for episode_id in episode_ids:
+            database.mark_dirty(episode_id)
+    if not _DEFERRED_PUSH.is_set():
+        _DEFERRED_PUSH.set()
+        kodi.ADDON.setSettingBool('deferred_push', True)
+
+
+def has_deferred_episodes():
+    # type: () -> bool
+    """Check if there are episodes that were not pushed because of TVmaze outage"""
+    return _DEFERRED_PUSH.is_set()
+
+
+def push_deferred_episodes():
+    # type: () -> None
+    """Push episodes that were deferred during TVmaze outage"""
+    if not tvmaze.is_authorized():
+        logger.warning('Addon is not authorized')
+        return
+    _DEFERRED_PUSH.clear()
+    success = push_changed_episodes(DeferredEpisodesDb)
+    if tvmaze.CIRCUIT_BREAKER.is_open:
+        _DEFERRED_PUSH.set()
+    elif success is not None:
+        notify_sync_completed(success)
+    kodi.ADDON.setSettingBool('deferred_push', _DEFERRED_PUSH.is_set())
+
+
+def push_single_episode(episode_id):
+    # type: (int) -> None
+    """Push watched status for a single episode"""
+    if not tvmaze.is_authorized():
+        logger.warning('Addon is not authorized')
+        return
+    if tvmaze.CIRCUIT_BREAKER.is_open:
+        _defer_episode_pushes([episode_id])
+        return
+    logger.debug('Pushing single episode to TVmaze')
+    episode_info = medialib.get_episode_details(episode_id)
+    tvshow_info = medialib.TVSHOW_CACHE.get(episode_info['tvshowid'])
+    tvmaze_id = get_tvmaze_id(tvshow_info)
+    if tvmaze_id is None:
+        logger.error(
+            'Unable to determine TVmaze id from show info: {}'.format(pformat(tvshow_info)))
+        return
+    episodes_by_id, episodes_by_numbering = prepare_episode_lists([episode_info])
+    try:
+        push_episode_records(episodes_by_id, episodes_by_numbering, tvmaze_id)
+    except tvmaze.ServiceUnavailableError:
+        _defer_episode_pushes([episode_id])
+        return
+    except tvmaze.TvMazeApiError as exc:
+        logger.error('Failed to push episode status: {}'.format(exc))
+        if six.text_type(exc) == tvmaze.AUTHENTICATION_ERROR:
+            handle_authentication_error()
+        else:
+            gui.DIALOG.notification(kodi.ADDON_NAME,
+                                    _('Failed to sync episode status'),
+                                    icon='error')
+        return
+    if kodi.ADDON.getSettingBool('show_notifications'):
+        gui.DIALOG.notification(kodi.ADDON_NAME,
+                                _('Synced episode status'), icon=kodi.ADDON_ICON, time=3000,
+                                sound=False)
+
+
+def push_episodes(episode_ids):
+    # type: (List[int]) -> None
+    """
+    Push watched statuses for several episodes at once
+
+    It is used for bursts of playcount changes, e.g. when a whole season
+    is marked as watched, so that episodes are pushed with a few requests.
+    """
+    if not tvmaze.is_authorized():
+        logger.warning('Addon is not authorized')
+        return
+    if tvmaze.CIRCUIT_BREAKER.is_open:
+        _defer_episode_pushes(episode_ids)
+        return
+    logger.debug('Pushing {} episodes to TVmaze'.format(len(episode_ids)))
+    episodes = [episode_info for episode_info in medialib.get_episodes_details(episode_ids)
+                if episode_info is not None]
+    push_result = push_kodi_episodes(episodes)
+    if push_result is None:
+        return
+    pushed_episode_ids, success = push_result
+    if tvmaze.CIRCUIT_BREAKER.is_open:
+        pushed_episode_ids = set(pushed_episode_ids)
+        _defer_episode_pushes([episode['episodeid'] for episode in episodes
+                               if episode['episodeid'] not in pushed_episode_ids])
+        return
+    notify_sync_completed(success)
+
+
+def push_kodi_episodes(kodi_episodes):
+    # type: (List[Dict[Text, Any]]) -> Optional[Tuple[List[int], bool]]
+    """
+    Push Kodi episodes of any TV shows to TVmaze
+
+    Episodes of TV shows without a resolvable TVmaze ID cannot be pushed
+    by retrying, so they are returned as done along with pushed episodes.
+
+    :return: (Kodi IDs of pushed episodes and episodes of shows without TVmaze ID,
+        success flag) tuple or ``None`` on authentication error
+    """
+    success = True
+    done_episode_ids = []
+    id_mapping = {}  # type: Dict[int, Optional[int]]
+    episode_mapping = defaultdict(list)
+    for episode in kodi_episodes:
+        if episode['tvshowid'] not in id_mapping:
+            show_info = medialib.TVSHOW_CACHE.get(episode['tvshowid'])
+            id_mapping[episode['tvshowid']] = get_tvmaze_id(show_info)
+            if id_mapping[episode['tvshowid']] is None:
+                logger.error(
+                    'Unable to determine TVmaze id from show info: {}'.format(pformat(show_info)))
+        tvmaze_id = id_mapping[episode['tvshowid']]
+        if tvmaze_id is None:
+            done_episode_ids.append(episode['episodeid'])
+        else:
+            episode_mapping[tvmaze_id].append(episode)
+    for tvmaze_id, episodes in six.iteritems(episode_mapping):
+        episodes_by_id, episodes_by_numbering = prepare_episode_lists(episodes)
+        try:
+            push_episode_records(episodes_by_id, episodes_by_numbering, tvmaze_id)
+        except tvmaze.TvMazeApiError as exc:
+            logger.error('Unable to update episodes for show {}: {}'.format(tvmaze_id, exc))
+            if six.text_type(exc) == tvmaze.AUTHENTICATION_ERROR:
+                handle_authentication_error()
+                return None
+            success = False
+            if isinstance(exc, tvmaze.ServiceUnavailableError):
+                break
+            continue
+        done_episode_ids.extend(episode['episodeid'] for episode in episodes)
+    return done_episode_ids, success
+
+
+def notify_sync_completed(success, error_icon='error'):
+    # type: (bool, Text) -> None
+    if success and kodi.ADDON.getSettingBool('show_notifications'):
+        gui.DIALOG.notification(kodi.ADDON_NAME, _('Sync completed'), icon=kodi.ADDON_ICON,
+                                time=3000, sound=False)
+    else:
+        gui.DIALOG.notification(kodi.ADDON_NAME,
+                                _('Sync completed with errors. Check the log for more info.'),
+                                icon=error_icon)
+
+
+def push_changed_episodes(journal_db=LibraryJournalDb):
+    # type: (Type[LibraryJournalDb]) -> Optional[bool]
+    """
+    Push episodes from a journal to TVmaze in batches
+
+    Successfully pushed and removed episodes are cleared from the journal.
+    The journal is paged by episode ID rather than by offset because
+    higher priority jobs that run between batches may clear journal entries too.
+
+    :param journal_db: the library change journal or the deferred episodes journal
+    :return: success flag or ``None`` if there were no episodes in the journal
+    """
+    success = None  # type: Optional[bool]
+    last_episode_id = -1
+    while True:
+        yield_to_higher_priority()
+        with journal_db() as database:
+            episode_ids = database.get_dirty_episodes(CHANGED_EPISODES_BATCH_SIZE,
+                                                      last_episode_id)
+        if not episode_ids:
+            break
+        last_episode_id = episode_ids[-1]
+        logger.debug('Pushing {} changed episodes to TVmaze'.format(len(episode_ids)))
+        episodes = []
+        done_episode_ids = []
+        for episode_id, episode_info in zip(episode_ids,
+                                            medialib.get_episodes_details(episode_ids)):
+            if episode_info is None:
+                done_episode_ids.append(episode_id)  # The episode has been removed
+            else:
+                episodes.append(episode_info)
+        push_result = push_kodi_episodes(episodes)
+        if push_result is None:
+            return False
+        pushed_episode_ids, batch_success = push_result
+        # Episodes of shows without TVmaze ID are cleared too, or they are re-read forever
+        done_episode_ids.extend(pushed_episode_ids)
+        with journal_db() as database:
+            database.remove_episodes(done_episode_ids)
+        # Failed episodes stay in the journal and are skipped until the next sync
+        success = batch_success if success is None else success and batch_success
+        if tvmaze.CIRCUIT_BREAKER.is_open:
+            return False
+    return success
@@ -0,0 +1,120 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Compact episode records used between Kodi medialibrary and TVmaze"""
+# pylint: disable=missing-docstring
+from __future__ import absolute_import, unicode_literals
+
+try:
+    # pylint: disable=unused-import
+    from typing import Text, Dict, Any, List, Iterable, Optional
+except ImportError:
+    pass
+
+
+class StatusType(object):  # pylint: disable=too-few-public-methods
+    """Episode statuses on TVmaze"""
+    WATCHED = 0
+    ACQUIRED = 1
+    SKIPPED = 2
+
+
+class EpisodeRecord(object):
+    """
+    Scrobbling info for a single Kodi episode
+
+    Only the fields needed to scrobble an episode to TVmaze are kept
+    so that whole-library passes do not need to hold raw JSON-RPC dicts.
+    """
+    __slots__ = ('episodeid', 'tvshowid', 'season', 'episode', 'tvmaze_id', 'type',
+                 'marked_at', 'firstaired')
+
+    # A record is a plain value object built by from_kodi_episode(),
+    # so it takes every field as a constructor argument.
+    def __init__(self, episodeid, tvshowid, season, episode,  # pylint: disable=too-many-arguments
+                 tvmaze_id, type_, marked_at, firstaired=None):
+        # type: (int, int, int, int, Optional[int], int, int, Optional[Text]) -> None
+        self.episodeid = episodeid
+        self.tvshowid = tvshowid
+        self.season = season
+        self.episode = episode
+        self.tvmaze_id = tvmaze_id
+        self.type = type_
+        self.marked_at = marked_at
+        self.firstaired = firstaired
+
+    @classmethod
+    def from_kodi_episode(cls, kodi_episode, marked_at):
+        # type: (Dict[Text, Any], int) -> EpisodeRecord
+        """
+        Create a record from episode info returned by Kodi JSON-RPC API
+
+        :param kodi_episode: Kodi episode info
+        :param marked_at: POSIX timestamp when the episode status has been set
+        """
+        uniqueid = kodi_episode.get('uniqueid') or {}
+        tvmaze_id = uniqueid.get('tvmaze')
+        return cls(
+            kodi_episode.get('episodeid'),
+            kodi_episode.get('tvshowid'),
+            kodi_episode.get('season'),
+            kodi_episode.get('episode'),
+            int(tvmaze_id) if tvmaze_id else None,
+            StatusType.WATCHED if kodi_episode.get('playcount') else StatusType.ACQUIRED,
+            marked_at,
+            kodi_episode.get('firstaired') or None
+        )
+
+    @property
+    def is_watched(self):
+        # type: () -> bool
+        return self.type == StatusType.WATCHED
+
+    @property
+    def has_numbering(self):
+        # type: () -> bool
+        return bool(self.season and self.episode)
+
+    def to_scrobble_info(self, by_id=True):
+        # type: (bool) -> Dict[Text, int]
+        """
+        Serialize the record to an item of TVmaze scrobble payload
+
+        :param by_id: serialize for ``/scrobble/episodes`` endpoint
+            (otherwise for ``/scrobble/shows``).
+        """
+        scrobble_info = {
+            'type': self.type,
+            'marked_at': self.marked_at,
+        }
+        if by_id:
+            scrobble_info['episode_id'] = self.tvmaze_id
+        else:
+            scrobble_info['season'] = self.season
+            scrobble_info['episode'] = self.episode
+        return scrobble_info
+
+    def __repr__(self):
+        return ('<EpisodeRecord episodeid={} tvshowid={} season={} episode={} '
+                'tvmaze_id={} type={} marked_at={}>').format(
+                    self.episodeid, self.tvshowid, self.season, self.episode,
+                    self.tvmaze_id, self.type, self.marked_at)
+
+
+def to_scrobble_payload(records, by_id=True):
+    # type: (Iterable[EpisodeRecord], bool) -> List[Dict[Text, int]]
+    """Serialize episode records to TVmaze scrobble payload"""
+    return [record.to_scrobble_info(by_id) for record in records]
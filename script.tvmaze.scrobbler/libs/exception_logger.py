@@ -17,27 +17,186 @@
 from __future__ import absolute_import, unicode_literals
 
 import inspect
+import itertools
+import re
 import sys
+import types
 from contextlib import contextmanager
 from platform import uname
 from pprint import pformat
 
 import six
-from kodi_six import xbmc
+from six.moves import reprlib
 
+from .kodi_compat import xbmc
 from .kodi_service import logger
 
 try:
-    from typing import Text, Dict, List, Callable, Generator  # pylint: disable=unused-import
+    # pylint: disable=unused-import
+    from typing import Text, Dict, List, Callable, Generator, Any, Iterable, Tuple
 except ImportError:
     pass
 
 
+MAX_VAR_LENGTH = 1000
+MAX_FRAME_VARS_LENGTH = 8000
+MAX_STACK_TRACE_LENGTH = 40000
+SENSITIVE_NAME_RE = re.compile(r'auth|apikey|api_key|password|token', re.I)
+SENSITIVE_JSON_VALUE_RE = re.compile(
+    r'("[^"]*(?:{})[^"]*"\s*:\s*)("(?:[^"\\]|\\.)*"|[^,}}\]\s]+)'.format(
+        SENSITIVE_NAME_RE.pattern), re.I)
+SENSITIVE_QUERY_VALUE_RE = re.compile(
+    r'([?&][^=&\s]*(?:{})[^=&\s]*=)[^&\s]*'.format(SENSITIVE_NAME_RE.pattern), re.I)
+REDACTED = '<redacted>'
+
+
+class _BoundedRepr(reprlib.Repr):
+    """
+    Repr with limited nesting and number of container items
+
+    Only the first items of containers and object attributes are visited
+    so formatting time does not depend on the size of the data.
+    Container subclasses (e.g. ``defaultdict`` or named tuples) and objects
+    with attributes are formatted the same way instead of falling back
+    to the full built-in ``repr``. Values with sensitive keys or attribute names
+    and sensitive values in JSON strings and URL query strings are redacted.
+    """
+
+    def __init__(self):
+        reprlib.Repr.__init__(self)
+        self.maxlevel = 4
+        self.maxdict = 10
+        self.maxlist = 10
+        self.maxtuple = 10
+        self.maxset = 10
+        self.maxstring = 200
+        self.maxother = 200
+
+    def _repr_items(self, items, size, level):
+        # type: (Iterable[Tuple[Any, Any]], int, int) -> List[Tuple[Any, Text]]
+        """
+        Get (key, value repr) pairs of the first items
+
+        A ``(None, text)`` pair is added for omitted items.
+        """
+        pieces = []
+        for key, value in itertools.islice(items, self.maxdict):
+            if isinstance(key, six.string_types) and SENSITIVE_NAME_RE.search(key):
+                value_repr = REDACTED
+            else:
+                value_repr = self.repr1(value, level - 1)
+            pieces.append((key, value_repr))
+        if size > self.maxdict:
+            pieces.append((None, '...({} items)'.format(size)))
+        return pieces
+
+    def repr1(self, x, level):
+        # pylint: disable=missing-docstring
+        if hasattr(self, 'repr_' + type(x).__name__):
+            return reprlib.Repr.repr1(self, x, level)
+        if isinstance(x, dict):
+            return '{}({})'.format(type(x).__name__, self.repr_dict(x, level))
+        if isinstance(x, tuple):
+            return self._repr_tuple_subclass(x, level)
+        if isinstance(x, list):
+            return '{}({})'.format(type(x).__name__, self.repr_list(x, level))
+        if (hasattr(x, '__dict__')
+                and not isinstance(x, (type, types.ModuleType, types.FunctionType,
+                                       types.MethodType, BaseException))):
+            return self._repr_object(x, level)
+        return reprlib.Repr.repr1(self, x, level)
+
+    def repr_dict(self, x, level):
+        # pylint: disable=missing-docstring
+        if not x:
+            return '{}'
+        if level <= 0:
+            return '{...}'
+        pieces = self._repr_items(((key, x[key]) for key in x), len(x), level)
+        return '{{{}}}'.format(', '.join(
+            value if key is None else '{}: {}'.format(self.repr1(key, level - 1), value)
+            for key, value in pieces))
+
+    def repr_defaultdict(self, x, level):
+        # pylint: disable=missing-docstring
+        return 'defaultdict({})'.format(self.repr_dict(x, level))
+
+    def _repr_tuple_subclass(self, x, level):
+        # pylint: disable=missing-docstring
+        fields = getattr(x, '_fields', None)
+        if fields is None:
+            return '{}({})'.format(type(x).__name__, self.repr_tuple(x, level))
+        if level <= 0:
+            return '{}(...)'.format(type(x).__name__)
+        return self._repr_attributes(type(x).__name__, six.moves.zip(fields, x), len(x), level)
+
+    def _repr_object(self, x, level):
+        # pylint: disable=missing-docstring
+        attributes = vars(x)
+        if level <= 0:
+            return '<{}...>'.format(type(x).__name__)
+        return self._repr_attributes(type(x).__name__, six.iteritems(attributes),
+                                     len(attributes), level)
+
+    def _repr_attributes(self, name, items, size, level):
+        # type: (Text, Iterable[Tuple[Text, Any]], int, int) -> Text
+        pieces = self._repr_items(items, size, level)
+        return '{}({})'.format(name, ', '.join(
+            value if key is None else '{}={}'.format(key, value) for key, value in pieces))
+
+    def repr_str(self, x, level):
+        # pylint: disable=missing-docstring
+        # Only the head of a string is shown, so only the head is redacted
+        return reprlib.Repr.repr_str(self, _redact_string(x[:self.maxstring]), level)
+
+    repr_unicode = repr_str
+
+    def repr_bytes(self, x, level):
+        # pylint: disable=missing-docstring
+        head = x[:self.maxstring]
+        try:
+            head = _redact_string(head.decode('utf-8')).encode('utf-8')
+        except UnicodeDecodeError:
+            pass
+        return reprlib.Repr.repr_str(self, head, level)
+
+    def repr_bytearray(self, x, level):
+        # pylint: disable=missing-docstring
+        return 'bytearray({})'.format(self.repr_bytes(bytes(x[:self.maxstring]), level))
+
+
+def _redact_string(string):
+    # type: (Text) -> Text
+    """Redact sensitive values in JSON and URL query strings"""
+    if not SENSITIVE_NAME_RE.search(string):
+        return string
+    string = SENSITIVE_JSON_VALUE_RE.sub(r'\1"{}"'.format(REDACTED), string)
+    return SENSITIVE_QUERY_VALUE_RE.sub(r'\1{}'.format(REDACTED), string)
+
+
+_REPR = _BoundedRepr()
+
+
+def _format_value(var, val):
+    # type: (Text, Any) -> Text
+    if SENSITIVE_NAME_RE.search(var):
+        return REDACTED
+    try:
+        val_repr = _REPR.repr(val)
+    except Exception as exc:  # pylint: disable=broad-except
+        val_repr = '<repr failed: {}>'.format(exc.__class__.__name__)
+    if len(val_repr) > MAX_VAR_LENGTH:
+        val_repr = val_repr[:MAX_VAR_LENGTH] + '...'
+    return val_repr
+
+
 def _format_vars(variables):
     # type: (dict) -> Text
     """
     Format variables dictionary
 
+    Values are formatted with limited length and credentials are redacted.
+
     :param variables: variables dict
     :return: formatted string with sorted ``var = val`` pairs
     """
@@ -45,8 +204,14 @@ def _format_vars(variables):
                 if not (var.startswith('__') or var.endswith('__'))]
     var_list.sort(key=lambda i: i[0])
     lines = []
-    for var, val in var_list:
-        lines.append('{} = {}'.format(var, pformat(val, indent=4)))
+    length = 0
+    for i, (var, val) in enumerate(var_list):
+        line = '{} = {}'.format(var, _format_value(var, val))
+        length += len(line)
+        if length > MAX_FRAME_VARS_LENGTH:
+            lines.append('... {} more variables omitted'.format(len(var_list) - i))
+            break
+        lines.append(line)
     return '\n'.join(lines)
 
 
@@ -74,17 +239,34 @@ Local variables:
 """
 
 
-def _format_frame_info(frame_info):
-    # type: (tuple) -> Text
+def _format_frame_info(frame_info, with_vars=True):
+    # type: (tuple, bool) -> Text
     return FRAME_INFO_TEMPLATE.format(
         file_path=frame_info[1],
         lineno=frame_info[2],
         code_context=_format_code_context(frame_info[4], frame_info[2],
                                           frame_info[5]),
-        local_vars=_format_vars(frame_info[0].f_locals)
+        local_vars=_format_vars(frame_info[0].f_locals) if with_vars else '(omitted)'
     )
 
 
+def _format_stack_trace(frame_infos):
+    # type: (List[tuple]) -> Text
+    """
+    Format stack trace within :const:`MAX_STACK_TRACE_LENGTH`
+
+    Inner frames are closer to the exception so local variables
+    of outer frames are omitted first when the limit is reached.
+    """
+    formatted_frames = []
+    length = 0
+    for frame_info in reversed(frame_infos):
+        formatted_frame = _format_frame_info(frame_info, with_vars=length < MAX_STACK_TRACE_LENGTH)
+        length += len(formatted_frame)
+        formatted_frames.append(formatted_frame)
+    return ''.join(reversed(formatted_frames))
+
+
 EXCEPTION_TEMPLATE = """
 *********************************** Unhandled exception detected ***********************************
 ####################################################################################################
@@ -140,9 +322,7 @@ def log_exception(logger_func=logger.error):
     try:
         yield
     except Exception as exc:
-        stack_trace = ''
-        for frame_info in inspect.trace(5):
-            stack_trace += _format_frame_info(frame_info)
+        stack_trace = _format_stack_trace(inspect.trace(5))
         message = EXCEPTION_TEMPLATE.format(
             exc_type=exc.__class__.__name__,
             exc=exc,
@@ -24,11 +24,10 @@ import weakref
 from contextlib import contextmanager
 
 import pyxbmct
-from kodi_six import xbmc
-from kodi_six.xbmcgui import Dialog, DialogProgressBG
 from six import text_type
 from six.moves import _thread as thread
 
+from .kodi_compat import xbmc, xbmcgui
 from .kodi_service import GETTEXT as _
 from .tvmaze_api import poll_authorization, AuthorizationError
 
@@ -37,7 +36,7 @@ try:
 except ImportError:
     pass
 
-DIALOG = Dialog()
+DIALOG = xbmcgui.Dialog()
 
 
 class ConfirmationLoop(threading.Thread):
@@ -130,8 +129,8 @@ class ConfirmationDialog(pyxbmct.AddonDialogWindow):  # pylint: disable=too-many
 
 @contextmanager
 def background_progress_dialog(heading, message):
-    # type: (Text, Text) -> Generator[DialogProgressBG, None, None]
-    dialog = DialogProgressBG()
+    # type: (Text, Text) -> Generator[xbmcgui.DialogProgressBG, None, None]
+    dialog = xbmcgui.DialogProgressBG()
     dialog.create(heading, message)
     try:
         yield dialog
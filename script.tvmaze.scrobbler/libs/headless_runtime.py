@@ -0,0 +1,280 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Minimal Kodi Python API runtime for running the sync engine outside Kodi
+
+:func:`install` must be called before any addon module is imported.
+It registers ``xbmc``, ``xbmcaddon``, ``xbmcgui``, ``xbmcvfs`` and ``pyxbmct``
+modules that implement only the parts of Kodi API used by the sync engine.
+Addon settings are stored in a JSON file in the profile directory
+except settings overridden at install time (e.g. credentials
+from environment variables) that are kept only in memory.
+"""
+# pylint: disable=missing-docstring,invalid-name,unused-argument,no-self-use
+from __future__ import absolute_import, unicode_literals
+
+import io
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import types
+from xml.etree import ElementTree
+
+try:
+    # pylint: disable=unused-import
+    from typing import Text, Dict, Optional
+except ImportError:
+    pass
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS_FILE = 'headless-settings.json'
+
+_log = logging.getLogger('script.tvmaze.scrobbler')
+
+
+def _read_addon_info():
+    # type: () -> Dict[Text, Text]
+    root = ElementTree.parse(os.path.join(ADDON_DIR, 'addon.xml')).getroot()
+    return {
+        'id': root.get('id'),
+        'name': root.get('name'),
+        'version': root.get('version'),
+        'path': ADDON_DIR,
+        'icon': os.path.join(ADDON_DIR, 'resources', 'images', 'icon.png'),
+    }
+
+
+def _read_default_settings():
+    # type: () -> Dict[Text, Text]
+    root = ElementTree.parse(os.path.join(ADDON_DIR, 'resources', 'settings.xml')).getroot()
+    defaults = {}
+    for setting in root.iter('setting'):
+        setting_id = setting.get('id')
+        if setting_id is None:
+            continue
+        default = setting.get('default')
+        if default is None and setting.get('type') == 'labelenum':
+            default = setting.get('values', '').split('|')[0]
+        defaults[setting_id] = default or ''
+    return defaults
+
+
+def _read_strings():
+    # type: () -> Dict[int, Text]
+    strings_po_path = os.path.join(
+        ADDON_DIR, 'resources', 'language', 'resource.language.en_gb', 'strings.po'
+    )
+    with io.open(strings_po_path, 'r', encoding='utf-8') as fo:
+        strings_po = fo.read()
+    id_string_pairs = re.findall(r'^msgctxt "#(\d+?)"\r?\nmsgid "(.*)"\r?$', strings_po, re.M)
+    return {int(string_id): string for string_id, string in id_string_pairs}
+
+
+class HeadlessAddon(object):
+    """Implementation of ``xbmcaddon.Addon`` that keeps settings in a JSON file"""
+
+    _lock = threading.Lock()
+    profile_dir = ''
+    overrides = {}  # type: Dict[Text, Text]
+
+    def __init__(self, id=None):  # pylint: disable=redefined-builtin
+        self._info = _read_addon_info()
+        self._info['profile'] = self.profile_dir
+        self._strings = None  # type: Optional[Dict[int, Text]]
+        self._settings_path = os.path.join(self.profile_dir, SETTINGS_FILE)
+
+    def _load_stored_settings(self):
+        # type: () -> Dict[Text, Text]
+        settings = _read_default_settings()
+        try:
+            with io.open(self._settings_path, 'r', encoding='utf-8') as fo:
+                settings.update(json.load(fo))
+        except (IOError, OSError, ValueError):
+            pass
+        return settings
+
+    def _load_settings(self):
+        # type: () -> Dict[Text, Text]
+        settings = self._load_stored_settings()
+        settings.update(self.overrides)
+        return settings
+
+    def getAddonInfo(self, info_id):
+        # type: (Text) -> Text
+        return self._info.get(info_id, '')
+
+    def getLocalizedString(self, string_id):
+        # type: (int) -> Text
+        if self._strings is None:
+            self._strings = _read_strings()
+        return self._strings.get(string_id, '')
+
+    def getSettingString(self, setting_id):
+        # type: (Text) -> Text
+        return self._load_settings().get(setting_id, '')
+
+    getSetting = getSettingString
+
+    def getSettingBool(self, setting_id):
+        # type: (Text) -> bool
+        return self.getSettingString(setting_id).lower() == 'true'
+
+    def getSettingInt(self, setting_id):
+        # type: (Text) -> int
+        return int(self.getSettingString(setting_id) or 0)
+
+    def setSettingString(self, setting_id, value):
+        # type: (Text, Text) -> bool
+        with self._lock:
+            if setting_id in self.overrides:
+                self.overrides[setting_id] = value
+                return True
+            settings = self._load_stored_settings()
+            settings[setting_id] = value
+            with io.open(self._settings_path, 'w', encoding='utf-8') as fo:
+                fo.write(json.dumps(settings, indent=2, ensure_ascii=False))
+        return True
+
+    setSetting = setSettingString
+
+    def setSettingBool(self, setting_id, value):
+        # type: (Text, bool) -> bool
+        return self.setSettingString(setting_id, 'true' if value else 'false')
+
+
+class HeadlessMonitor(object):
+    """Implementation of ``xbmc.Monitor`` that is aborted by :func:`request_abort`"""
+
+    abort_event = threading.Event()
+
+    def abortRequested(self):
+        # type: () -> bool
+        return self.abort_event.is_set()
+
+    def waitForAbort(self, timeout=None):
+        # type: (Optional[float]) -> bool
+        self.abort_event.wait(timeout)
+        return self.abort_event.is_set()
+
+
+class HeadlessDialog(object):
+    """Implementation of ``xbmcgui.Dialog`` that writes notifications to the log"""
+
+    def notification(self, heading, message, *args, **kwargs):
+        _log.info('%s: %s', heading, message)
+
+    def ok(self, heading, message):
+        _log.info('%s: %s', heading, message)
+        return True
+
+    def yesno(self, heading, message, *args, **kwargs):
+        _log.warning('Confirmation is not available in headless mode: %s', message)
+        return False
+
+    def select(self, heading, options, *args, **kwargs):
+        return -1
+
+
+class HeadlessProgressBG(object):
+    """Implementation of ``xbmcgui.DialogProgressBG`` that does nothing"""
+
+    def create(self, heading, message=''):
+        _log.info('%s: %s', heading, message)
+
+    def update(self, percent=0, heading='', message=''):
+        pass
+
+    def close(self):
+        pass
+
+
+class HeadlessKeyboard(object):
+
+    def doModal(self):
+        pass
+
+    def isConfirmed(self):
+        return False
+
+    def getText(self):
+        return ''
+
+
+_LOG_LEVELS = {
+    0: logging.DEBUG,
+    1: logging.INFO,
+    2: logging.WARNING,
+    3: logging.ERROR,
+    4: logging.CRITICAL,
+}
+
+
+def _kodi_log(message, level=0):
+    # type: (Text, int) -> None
+    _log.log(_LOG_LEVELS.get(level, logging.INFO), message)
+
+
+def _create_module(name, **attrs):
+    module = types.ModuleType(str(name))
+    module.__dict__.update(attrs)
+    return module
+
+
+def request_abort():
+    # type: () -> None
+    """Signal all headless monitors to abort"""
+    HeadlessMonitor.abort_event.set()
+
+
+def install(profile_dir, settings_overrides=None):
+    # type: (Text, Optional[Dict[Text, Text]]) -> None
+    """
+    Register headless Kodi API modules
+
+    :param profile_dir: directory for addon settings and databases
+    :param settings_overrides: addon settings that are kept only in memory
+        and never written to the settings file, e.g. credentials
+    """
+    profile_dir = os.path.abspath(profile_dir)
+    if not os.path.exists(profile_dir):
+        os.makedirs(profile_dir)
+    HeadlessAddon.profile_dir = profile_dir
+    HeadlessAddon.overrides = dict(settings_overrides or {})
+    modules = {
+        'xbmc': _create_module(
+            'xbmc',
+            LOGDEBUG=0, LOGINFO=1, LOGWARNING=2, LOGERROR=3, LOGFATAL=4,
+            log=_kodi_log,
+            Monitor=HeadlessMonitor,
+            Keyboard=HeadlessKeyboard,
+            executeJSONRPC=None,  # JSON-RPC goes through medialibrary_api transport
+            getCondVisibility=lambda condition: False,
+            getInfoLabel=lambda label: 'headless',
+            translatePath=lambda path: path,
+        ),
+        'xbmcaddon': _create_module('xbmcaddon', Addon=HeadlessAddon),
+        'xbmcgui': _create_module(
+            'xbmcgui', Dialog=HeadlessDialog, DialogProgressBG=HeadlessProgressBG
+        ),
+        'xbmcvfs': _create_module('xbmcvfs', translatePath=lambda path: path),
+        # Authorization dialog is not available in headless mode
+        'pyxbmct': _create_module('pyxbmct', AddonDialogWindow=object, ACTION_NAV_BACK=92),
+    }
+    sys.modules.update(modules)
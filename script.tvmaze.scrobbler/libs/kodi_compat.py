@@ -0,0 +1,41 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Kodi Python API modules for the current Python version
+
+On Python 3 Kodi API accepts and returns native strings, so Kodi modules
+are used directly and hot calls (JSON-RPC, logging, settings) do not go
+through kodi_six string conversion wrappers. On Python 2 kodi_six wrappers
+are used to convert between byte and unicode strings.
+"""
+# pylint: disable=unused-import,import-error
+from __future__ import absolute_import
+
+import six
+
+if six.PY2:
+    from kodi_six import xbmc, xbmcaddon, xbmcgui, xbmcvfs
+else:
+    import xbmc
+    import xbmcaddon
+    import xbmcgui
+    import xbmcvfs
+
+try:
+    translatePath = xbmcvfs.translatePath  # pylint: disable=invalid-name
+except AttributeError:
+    translatePath = xbmc.translatePath  # pylint: disable=invalid-name
@@ -23,22 +23,18 @@ import inspect
 import os
 import re
 
-from kodi_six import xbmc
-from kodi_six.xbmcaddon import Addon
 from six.moves import cPickle as pickle
 
-try:
-    from kodi_six.xbmcvfs import translatePath  # pylint: disable=ungrouped-imports
-except (ImportError, AttributeError):
-    from kodi_six.xbmc import translatePath
+from .kodi_compat import xbmc, xbmcaddon, translatePath
 
 try:
-    from typing import Text, Dict, Callable, Generator  # pylint: disable=unused-import
+    # pylint: disable=unused-import
+    from typing import Text, Dict, Callable, Generator, Optional, Tuple, Any
 except ImportError:
     pass
 
 
-ADDON = Addon()
+ADDON = xbmcaddon.Addon()
 ADDON_ID = ADDON.getAddonInfo('id')
 ADDON_NAME = ADDON.getAddonInfo('name')
 ADDON_VERSION = ADDON.getAddonInfo('version')
@@ -101,41 +97,72 @@ class LocalizationService(object):
         self._en_gb_string_po_path = os.path.join(
             ADDON_DIR, 'resources', 'language', 'resource.language.en_gb', 'strings.po'
         )
-        if not os.path.exists(self._en_gb_string_po_path):
-            raise self.LocalizationError('Missing English strings.po localization file')
         self._string_mapping_path = os.path.join(ADDON_PROFILE_DIR, 'strings-map.pickle')
-        self._mapping = self._load_strings_mapping()  # type: Dict[Text, int]
+        self._mapping = None  # type: Optional[Dict[Text, int]]
+
+    @property
+    def mapping(self):
+        # type: () -> Dict[Text, int]
+        """UI strings mapping that is loaded on first access"""
+        if self._mapping is None:
+            self._mapping = self._load_strings_mapping()
+        return self._mapping
 
     def _load_strings_po(self):  # pylint: disable=missing-docstring
         # type: () -> bytes
         with open(self._en_gb_string_po_path, 'rb') as fo:
             return fo.read()
 
+    def _get_strings_po_stamp(self):
+        # type: () -> Tuple[int, float]
+        """
+        Get cheap change stamp of English strings.po file
+
+        :return: (file size, modification time) tuple
+        :raises LocalizationError: if English strings.po file is missing
+        """
+        try:
+            stat = os.stat(self._en_gb_string_po_path)
+        except OSError:
+            raise self.LocalizationError('Missing English strings.po localization file')
+        return stat.st_size, stat.st_mtime
+
+    def _save_strings_mapping(self, mapping):  # pylint: disable=missing-docstring
+        # type: (Dict[Text, Any]) -> None
+        with open(self._string_mapping_path, 'wb') as fo:
+            pickle.dump(mapping, fo, protocol=2)
+
     def _load_strings_mapping(self):
         # type: () -> Dict[Text, int]
         """
         Load mapping of English UI strings to their IDs
 
-        If a mapping file is missing or English strins.po file has been updated,
-        a new mapping file is created.
+        The cached mapping is validated by size and modification time
+        of English strings.po file. Only if those have changed
+        strings.po file is read and its MD5 hash is compared
+        with the cached one. If a mapping file is missing or English strings.po file
+        has been updated, a new mapping file is created.
 
         :return: UI strings mapping
         """
-        strings_po = self._load_strings_po()
-        strings_po_md5 = hashlib.md5(strings_po).hexdigest()
+        size, mtime = self._get_strings_po_stamp()
         try:
             with open(self._string_mapping_path, 'rb') as fo:
                 mapping = pickle.load(fo)
-            if mapping['md5'] != strings_po_md5:
-                raise IOError('English strings.po has been updated')
-        except IOError:
-            strings_mapping = self._parse_strings_po(strings_po.decode('utf-8'))
+        except (IOError, EOFError, pickle.UnpicklingError):
+            mapping = {}
+        if mapping.get('size') == size and mapping.get('mtime') == mtime:
+            return mapping['strings']
+        strings_po = self._load_strings_po()
+        strings_po_md5 = hashlib.md5(strings_po).hexdigest()
+        if mapping.get('md5') != strings_po_md5:
             mapping = {
-                'strings': strings_mapping,
+                'strings': self._parse_strings_po(strings_po.decode('utf-8')),
                 'md5': strings_po_md5,
             }
-            with open(self._string_mapping_path, 'wb') as fo:
-                pickle.dump(mapping, fo, protocol=2)
+        mapping['size'] = size
+        mapping['mtime'] = mtime
+        self._save_strings_mapping(mapping)
         return mapping['strings']
 
     @staticmethod
@@ -160,7 +187,7 @@ class LocalizationService(object):
         :return: localized UI string
         """
         try:
-            string_id = self._mapping[en_string]
+            string_id = self.mapping[en_string]
         except KeyError:
             raise self.LocalizationError(
                 'Unable to find English string "{}" in strings.po'.format(en_string))
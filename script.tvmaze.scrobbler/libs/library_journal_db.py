@@ -0,0 +1,83 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# pylint: disable=missing-docstring
+"""
+The journals of Kodi episodes waiting to be pushed to TVmaze
+
+:class:`LibraryJournalDb` is used to push to TVmaze exactly the episodes
+that have been added or updated since the last sync.
+:class:`DeferredEpisodesDb` keeps watched status changes that have not been
+pushed because TVmaze API was unavailable. They are kept apart because
+library changes are pushed only after a library scan if it is enabled.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from .sqlite_db import SqliteDb, get_db_path
+
+try:
+    from typing import Iterable, List  # pylint: disable=unused-import
+except ImportError:
+    pass
+
+
+class LibraryJournalDb(SqliteDb):
+    DB = get_db_path('library-journal.sqlite')
+    TABLE = 'dirty_episodes'
+    SCHEMA = (
+        """
+            CREATE TABLE IF NOT EXISTS dirty_episodes(
+                episode_id INTEGER PRIMARY KEY,
+                timestamp INTEGER NOT NULL
+            )
+        """,
+    )
+
+    def mark_dirty(self, episode_id):
+        # type: (int) -> None
+        self._cursor.execute("""
+            INSERT OR REPLACE INTO {}
+            (episode_id, timestamp)
+            VALUES (?, STRFTIME('%s', 'now'))
+        """.format(self.TABLE), [episode_id])
+
+    def get_dirty_episodes(self, limit, after_episode_id=-1):
+        # type: (int, int) -> List[int]
+        self._cursor.execute("""
+            SELECT episode_id
+            FROM {}
+            WHERE episode_id > ?
+            ORDER BY episode_id
+            LIMIT ?
+        """.format(self.TABLE), [after_episode_id, limit])
+        return [row[0] for row in self._cursor.fetchall()]
+
+    def remove_episodes(self, episode_ids):
+        # type: (Iterable[int]) -> None
+        self._cursor.executemany('DELETE FROM {} WHERE episode_id = ?'.format(self.TABLE),
+                                 [(episode_id,) for episode_id in episode_ids])
+
+
+class DeferredEpisodesDb(LibraryJournalDb):
+    DB = get_db_path('library-journal.sqlite')
+    TABLE = 'deferred_episodes'
+    SCHEMA = (
+        """
+            CREATE TABLE IF NOT EXISTS deferred_episodes(
+                episode_id INTEGER PRIMARY KEY,
+                timestamp INTEGER NOT NULL
+            )
+        """,
+    )
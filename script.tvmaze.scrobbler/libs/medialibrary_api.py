@@ -19,22 +19,86 @@
 from __future__ import absolute_import, unicode_literals
 
 import json
+import threading
+from collections import OrderedDict
 from pprint import pformat
 
-from kodi_six import xbmc
+import requests
+import six
+from requests.adapters import HTTPAdapter
 
+from .kodi_compat import xbmc
 from .kodi_service import logger
 
 try:
-    from typing import Text, Optional, List, Dict, Any, Union  # pylint: disable=unused-import
+    # pylint: disable=unused-import
+    from typing import Text, Optional, List, Dict, Any, Union, Iterator, Tuple
 except ImportError:
     pass
 
 
+TVSHOW_PROPERTIES = ['uniqueid', 'episode', 'watchedepisodes']
+EPISODE_PROPERTIES = ['season', 'episode', 'playcount', 'tvshowid', 'uniqueid',
+                      'dateadded', 'lastplayed', 'firstaired']
+EPISODES_PAGE_SIZE = 500
+
+
 class NoDataError(Exception):  # pylint: disable=missing-docstring
     pass
 
 
+class KodiJsonRpcTransport(object):
+    """Send JSON-RPC requests via Kodi Python API"""
+
+    def execute(self, request):
+        # type: (Text) -> Text
+        return xbmc.executeJSONRPC(request)
+
+
+class HttpJsonRpcTransport(object):
+    """
+    Send JSON-RPC requests to Kodi web server over HTTP
+
+    It allows to run the sync engine in a separate Python process
+    outside Kodi. Connections are pooled and can be used from several threads.
+    """
+
+    def __init__(self, url, auth=None, pool_size=4, timeout=60.0):
+        # type: (Text, Optional[Tuple[Text, Text]], int, float) -> None
+        """
+        :param url: Kodi JSON-RPC URL, e.g. ``http://192.168.1.10:8080/jsonrpc``
+        :param auth: Kodi web server (username, password) tuple
+        :param pool_size: max number of pooled HTTP connections
+        :param timeout: request timeout in seconds
+        """
+        self._url = url
+        self._timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.headers['Content-Type'] = 'application/json'
+        if auth is not None:
+            self._session.auth = auth
+
+    def execute(self, request):
+        # type: (Text) -> Text
+        response = self._session.post(self._url, data=request.encode('utf-8'),
+                                      timeout=self._timeout)
+        response.raise_for_status()
+        return response.text
+
+
+TRANSPORT = KodiJsonRpcTransport()  # type: Union[KodiJsonRpcTransport, HttpJsonRpcTransport]
+
+
+def set_transport(transport):
+    # type: (Union[KodiJsonRpcTransport, HttpJsonRpcTransport]) -> None
+    """Set transport for sending JSON-RPC requests to Kodi"""
+    global TRANSPORT  # pylint: disable=global-statement
+    TRANSPORT = transport
+
+
 def send_json_rpc(method, params=None):
     # type: (Text, Optional[Dict[Text, Any]]) -> dict
     """
@@ -44,28 +108,56 @@ def send_json_rpc(method, params=None):
     if params is not None:
         request['params'] = params
     logger.debug('JSON-RPC request:\n{0}'.format(pformat(request)))
-    json_reply = json.loads(xbmc.executeJSONRPC(json.dumps(request)))
+    json_reply = json.loads(TRANSPORT.execute(json.dumps(request)))
     logger.debug('JSON-RPC reply:\n{0}'.format(pformat(json_reply)))
     return json_reply['result']
 
 
-def get_tvshows():
-    # type: () -> List[Dict[Text, Any]]
+def send_json_rpc_batch(calls):
+    # type: (List[Tuple[Text, Optional[Dict[Text, Any]]]]) -> List[Any]
+    """
+    Send a batch of JSON-RPC calls to Kodi in a single request
+
+    :param calls: the list of (method, params) tuples
+    :return: the list of call results in the same order as the calls
+    """
+    if not calls:
+        return []
+    request = []
+    for call_id, (method, params) in enumerate(calls):
+        call = {'jsonrpc': '2.0', 'method': method, 'id': call_id}
+        if params is not None:
+            call['params'] = params
+        request.append(call)
+    logger.debug('JSON-RPC batch request of {} calls'.format(len(request)))
+    json_reply = json.loads(TRANSPORT.execute(json.dumps(request)))
+    replies = {reply.get('id'): reply for reply in json_reply}
+    errors = [reply['error'] for reply in json_reply if 'error' in reply]
+    if errors:
+        logger.error('JSON-RPC batch errors:\n{0}'.format(pformat(errors)))
+    return [replies.get(call_id, {}).get('result') for call_id in range(len(calls))]
+
+
+def get_tvshows(properties=None):
+    # type: (Optional[List[Text]]) -> List[Dict[Text, Any]]
     """
     Get te list of TV shows from the Kodi database
+    :param properties: TV show properties to request
     :return: the list of TV show data as Python dicts.
     :raises NoDataError: if the Kodi library has no TV shows
 
     Example TV show data::
 
-        {u'label': u'Westworld',
+        {u'episode': 20,
+         u'label': u'Westworld',
          u'tvshowid': 45,
          u'uniqueid': {u'imdb': u'tt0475784',
                        u'tmdb': u'63247',
-                       u'tvdb': u'296762'}}
+                       u'tvdb': u'296762'},
+         u'watchedepisodes': 10}
     """
     params = {
-        'properties': ['uniqueid'],
+        'properties': properties or TVSHOW_PROPERTIES,
         'sort': {'order': 'ascending', 'method': 'label'}
     }
     result = send_json_rpc('VideoLibrary.GetTVShows', params)
@@ -74,13 +166,14 @@ def get_tvshows():
     return result['tvshows']
 
 
-def get_episodes(tvshowid, filter_=None):
-    # type: (int, Optional[Dict[Text, Any]]) -> List[Dict[Text, Any]]
+def get_episodes(tvshowid, filter_=None, properties=None):
+    # type: (int, Optional[Dict[Text, Any]], Optional[List[Text]]) -> List[Dict[Text, Any]]
     """
     Get the list of episodes from a specific TV show
 
     :param tvshowid: internal Kodi database ID for a TV show
     :param filter_: filter for episodes
+    :param properties: episode properties to request (all supported properties by default)
     :return: the list of episode data as Python dicts.
     :raises NoDataError: if a TV show has no episodes.
 
@@ -95,8 +188,7 @@ def get_episodes(tvshowid, filter_=None):
     """
     params = {
         'tvshowid': tvshowid,
-        'properties': ['season', 'episode', 'playcount', 'tvshowid', 'uniqueid',
-                       'dateadded', 'lastplayed', 'firstaired']
+        'properties': properties or EPISODE_PROPERTIES,
     }
     if filter_ is not None:
         params['filter'] = filter_
@@ -106,6 +198,76 @@ def get_episodes(tvshowid, filter_=None):
     return result['episodes']
 
 
+def iter_library_episodes(properties=None, filter_=None, page_size=EPISODES_PAGE_SIZE, start=0):
+    # type: (Optional[List[Text]], Optional[Dict[Text, Any]], int, int) -> Iterator[Dict[Text, Any]]
+    """
+    Iterate over all episodes in the Kodi medialibrary
+
+    Episodes are requested library-wide in pages of ``page_size`` items
+    sorted by TV show, so only one page is kept in memory at a time.
+
+    :param properties: episode properties to request (all supported properties by default)
+    :param filter_: filter for episodes
+    :param page_size: the number of episodes requested in one JSON-RPC call
+    :param start: the position in the episode list to start from
+    :return: episode data as Python dicts
+    """
+    properties = list(properties or EPISODE_PROPERTIES)
+    if 'tvshowid' not in properties:
+        properties.append('tvshowid')
+    params = {
+        'properties': properties,
+        'sort': {'order': 'ascending', 'method': 'tvshowtitle'},
+    }
+    if filter_ is not None:
+        params['filter'] = filter_
+    while True:
+        params['limits'] = {'start': start, 'end': start + page_size}
+        result = send_json_rpc('VideoLibrary.GetEpisodes', params)
+        episodes = result.get('episodes')
+        if not episodes:
+            return
+        for episode in episodes:
+            yield episode
+        start += len(episodes)
+        total = result.get('limits', {}).get('total')
+        if total is not None and start >= total:
+            return
+
+
+def iter_episodes_by_tvshow(properties=None, filter_=None, page_size=EPISODES_PAGE_SIZE):
+    # type: (Optional[List[Text]], Optional[dict], int) -> Iterator[Tuple[int, List[dict]]]
+    """
+    Iterate over all episodes in the Kodi medialibrary grouped by TV show
+
+    The episodes are grouped on the fly while paging through
+    the library-wide episode list. Kodi sorts episodes only by TV show title,
+    so episodes of different shows with the same title may be interleaved.
+    That is why episodes are collected until the title changes
+    and only then the shows with that title are yielded.
+
+    :param properties: episode properties to request (all supported properties by default)
+    :param filter_: filter for episodes
+    :param page_size: the number of episodes requested in one JSON-RPC call
+    :return: (tvshowid, the list of show episodes) tuples
+    """
+    properties = list(properties or EPISODE_PROPERTIES)
+    if 'showtitle' not in properties:
+        properties.append('showtitle')
+    current_title = None
+    current_shows = OrderedDict()  # type: Dict[int, List[Dict[Text, Any]]]
+    for episode in iter_library_episodes(properties, filter_, page_size):
+        title = (episode.get('showtitle') or '').strip().lower()
+        if title != current_title:
+            for item in six.iteritems(current_shows):
+                yield item
+            current_title = title
+            current_shows = OrderedDict()
+        current_shows.setdefault(episode['tvshowid'], []).append(episode)
+    for item in six.iteritems(current_shows):
+        yield item
+
+
 def get_recent_episodes():
     # type: () -> List[Dict[Text, Any]]
     """
@@ -157,9 +319,37 @@ def get_episode_details(episode_id):
     return send_json_rpc(method, params)['episodedetails']
 
 
-def set_episode_playcount(episode_id, playcount=1, last_played=None):
-    # type: (int, int, Optional[Text]) -> None
-    original_playcount = get_episode_details(episode_id)['playcount']
+def get_episodes_details(episode_ids):
+    # type: (List[int]) -> List[Optional[Dict[Text, Any]]]
+    """
+    Get details of multiple episodes with a batch JSON-RPC request
+
+    :param episode_ids: Kodi episode IDs
+    :return: the list of episode details in the same order as episode IDs.
+        Missing episodes are returned as ``None``.
+    """
+    calls = [
+        ('VideoLibrary.GetEpisodeDetails',
+         {'episodeid': episode_id, 'properties': EPISODE_PROPERTIES})
+        for episode_id in episode_ids
+    ]
+    return [result['episodedetails'] if result else None
+            for result in send_json_rpc_batch(calls)]
+
+
+def set_episode_playcount(episode_id, playcount=1, last_played=None, original_playcount=None):
+    # type: (int, int, Optional[Text], Optional[int]) -> None
+    """
+    Set episode playcount
+
+    :param episode_id: episode ID in Kodi database
+    :param playcount: new playcount
+    :param last_played: last played time
+    :param original_playcount: current episode playcount if it is already known
+        (otherwise it is requested from Kodi).
+    """
+    if original_playcount is None:
+        original_playcount = get_episode_details(episode_id)['playcount']
     if playcount != int(bool(original_playcount)):
         method = 'VideoLibrary.SetEpisodeDetails'
         params = {'episodeid': episode_id, 'playcount': playcount}
@@ -177,3 +367,89 @@ def set_show_uniqueid(tvshow_id, external_id, provider='tvmaze'):
         'uniqueid': {provider: str(external_id)},
     }
     send_json_rpc(method, params)
+    TVSHOW_CACHE.update_uniqueid(tvshow_id, external_id, provider)
+
+
+def set_episode_uniqueids(episode_ids, provider='tvmaze'):
+    # type: (List[Tuple[int, Union[Text, int]]], Text) -> List[Any]
+    """
+    Set unique_id for multiple episodes with a batch JSON-RPC request
+
+    :param episode_ids: the list of (Kodi episode ID, external ID) tuples
+    :param provider: external ID provider
+    :return: the list of call results (``None`` for failed calls)
+    """
+    calls = [
+        ('VideoLibrary.SetEpisodeDetails',
+         {'episodeid': episode_id, 'uniqueid': {provider: str(external_id)}})
+        for episode_id, external_id in episode_ids
+    ]
+    return send_json_rpc_batch(calls)
+
+
+class TvShowCache(object):
+    """
+    In-process cache of TV show info from the Kodi medialibrary
+
+    The cache is preloaded with a single ``VideoLibrary.GetTVShows`` call
+    on the first access and is kept coherent by invalidating items
+    on medialibrary update notifications.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self._shows = {}  # type: Dict[int, Dict[Text, Any]]
+        self._is_loaded = False
+        self._lock = threading.RLock()
+
+    def _preload(self):
+        # type: () -> None
+        try:
+            tvshows = get_tvshows()
+        except NoDataError:
+            tvshows = []
+        self._shows = {show['tvshowid']: show for show in tvshows}
+        self._is_loaded = True
+
+    def get(self, tvshow_id):
+        # type: (int) -> Dict[Text, Any]
+        """
+        Get TV show info
+
+        :param tvshow_id: show ID in Kodi database
+        :return: show info
+        """
+        tvshow_id = int(tvshow_id)
+        with self._lock:
+            if not self._is_loaded:
+                self._preload()
+            show_info = self._shows.get(tvshow_id)
+            if show_info is None:
+                show_info = self._shows[tvshow_id] = get_tvshow_details(tvshow_id)
+            return show_info
+
+    def update_uniqueid(self, tvshow_id, external_id, provider='tvmaze'):
+        # type: (int, Union[Text, int], Text) -> None
+        """Update unique_id of a cached TV show"""
+        with self._lock:
+            show_info = self._shows.get(int(tvshow_id))
+            if show_info is not None:
+                show_info.setdefault('uniqueid', {})[provider] = str(external_id)
+
+    def invalidate(self, tvshow_id=None):
+        # type: (Optional[int]) -> None
+        """
+        Remove a TV show from the cache
+
+        :param tvshow_id: show ID in Kodi database. If ``None``
+            the whole cache is cleared.
+        """
+        with self._lock:
+            if tvshow_id is None:
+                self._shows = {}
+                self._is_loaded = False
+            else:
+                self._shows.pop(int(tvshow_id), None)
+
+
+TVSHOW_CACHE = TvShowCache()
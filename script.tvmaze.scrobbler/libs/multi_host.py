@@ -0,0 +1,131 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Sync several Kodi instances with one TVmaze account from one process
+
+TVmaze show lookups and watchlists are fetched once per sync cycle
+and reused for every Kodi host. Databases with Kodi-specific IDs
+are kept in a separate directory for each host, while the TVmaze
+episode catalog is shared.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import io
+import json
+import os
+import re
+
+import requests
+
+from . import medialibrary_api as medialib, scrobbling_service as scrobbler, tvmaze_api as tvmaze
+from .episode_links_db import EpisodeLinksDb
+from .kodi_service import ADDON_PROFILE_DIR, logger
+from .library_journal_db import DeferredEpisodesDb, LibraryJournalDb
+from .pull_schedule_db import PullScheduleDb
+from .pulled_episodes_db import PulledEpisodesDb
+
+try:
+    # pylint: disable=unused-import
+    from typing import Text, List, Dict, Any, Optional
+    import xbmc
+except ImportError:
+    pass
+
+HOSTS_DIR = 'hosts'
+HOST_DATABASES = (DeferredEpisodesDb, EpisodeLinksDb, LibraryJournalDb, PulledEpisodesDb,
+                  PullScheduleDb)
+
+
+class KodiHost(object):
+    """Kodi instance that is accessed via JSON-RPC HTTP API"""
+
+    def __init__(self, name, url, username=None, password=None):
+        # type: (Text, Text, Optional[Text], Optional[Text]) -> None
+        self.name = name
+        self.transport = medialib.HttpJsonRpcTransport(
+            url, (username, password or '') if username else None)
+        self.tvshow_cache = medialib.TvShowCache()
+        self.profile_dir = os.path.join(
+            ADDON_PROFILE_DIR, HOSTS_DIR, re.sub(r'[^\w.-]', '_', name))
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir)
+
+    def activate(self):
+        # type: () -> None
+        """Direct Kodi requests and database access to this host"""
+        medialib.set_transport(self.transport)
+        medialib.TVSHOW_CACHE = self.tvshow_cache
+        for database in HOST_DATABASES:
+            database.DB = os.path.join(self.profile_dir, os.path.basename(database.DB))
+
+
+def load_hosts(config_path):
+    # type: (Text) -> List[KodiHost]
+    """
+    Load Kodi hosts from a JSON config file
+
+    Example::
+
+        [
+            {"name": "living-room", "url": "http://192.168.1.10:8080/jsonrpc",
+             "username": "kodi", "password": "kodi"},
+            {"name": "bedroom", "url": "http://192.168.1.11:8080/jsonrpc"}
+        ]
+
+    :param config_path: path to the config file
+    :return: the list of Kodi hosts
+    """
+    with io.open(config_path, 'r', encoding='utf-8') as fo:
+        config = json.load(fo)  # type: List[Dict[Text, Any]]
+    return [KodiHost(item['name'], item['url'], item.get('username'), item.get('password'))
+            for item in config]
+
+
+def sync_hosts(hosts, base_interval):
+    # type: (List[KodiHost], int) -> None
+    """
+    Pull watched episodes from TVmaze to every Kodi host that is due
+
+    :param hosts: Kodi hosts
+    :param base_interval: pull interval for active shows in seconds
+    """
+    tvmaze.WATCHLIST_CACHE.clear()
+    for host in hosts:
+        logger.info('Syncing Kodi host "{}"'.format(host.name))
+        host.activate()
+        try:
+            scrobbler.pull_watched_episodes_by_priority(base_interval)
+        except requests.RequestException as exc:
+            logger.error('Unable to sync Kodi host "{}": {}'.format(host.name, exc))
+
+
+def run_daemon(hosts, base_interval, monitor):
+    # type: (List[KodiHost], int, xbmc.Monitor) -> None
+    """
+    Sync Kodi hosts every ``base_interval`` seconds until abort is requested
+
+    :param hosts: Kodi hosts
+    :param base_interval: pull interval for active shows in seconds
+    :param monitor: monitor instance
+    """
+    tvmaze.WATCHLIST_CACHE.enabled = True
+    tvmaze.SHOW_LOOKUP_CACHE.enabled = True
+    while True:
+        sync_hosts(hosts, base_interval)
+        if monitor.waitForAbort(base_interval):
+            break
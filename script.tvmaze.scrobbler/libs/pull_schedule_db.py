@@ -0,0 +1,103 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# pylint: disable=missing-docstring
+"""
+The database of per-show pull schedule
+
+It is used to pull recently active TV shows more often than inactive ones.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import heapq
+
+from .sqlite_db import SqliteDb, get_db_path
+
+try:
+    from typing import Iterable, List, Optional  # pylint: disable=unused-import
+except ImportError:
+    pass
+
+DAY = 24 * 3600
+# (max activity age in seconds, base pull interval multiplier)
+ACTIVITY_TIERS = (
+    (30 * DAY, 1),
+    (180 * DAY, 4),
+)
+INACTIVE_MULTIPLIER = 16
+
+
+def get_pull_interval(last_activity, base_interval, now):
+    # type: (Optional[int], int, int) -> int
+    """
+    Get pull interval for a TV show depending on its recent activity
+
+    :param last_activity: POSIX timestamp of the latest show activity
+    :param base_interval: pull interval for active shows in seconds
+    :param now: current POSIX timestamp
+    :return: pull interval in seconds
+    """
+    if last_activity is not None:
+        activity_age = now - last_activity
+        for max_age, multiplier in ACTIVITY_TIERS:
+            if activity_age <= max_age:
+                return base_interval * multiplier
+    return base_interval * INACTIVE_MULTIPLIER
+
+
+class PullScheduleDb(SqliteDb):
+    DB = get_db_path('pull-schedule.sqlite')
+    SCHEMA = (
+        """
+            CREATE TABLE IF NOT EXISTS pull_schedule(
+                tvshow_id INTEGER PRIMARY KEY,
+                last_activity INTEGER,
+                next_pull INTEGER NOT NULL
+            )
+        """,
+    )
+
+    def get_due_shows(self, tvshow_ids, now):
+        # type: (Iterable[int], int) -> List[int]
+        """
+        Get TV shows that are due for pulling ordered by priority
+
+        Shows that have never been pulled go first, then shows
+        that are overdue the most.
+
+        :param tvshow_ids: Kodi IDs of TV shows in the medialibrary
+        :param now: current POSIX timestamp
+        :return: the list of Kodi TV show IDs
+        """
+        self._cursor.execute('SELECT tvshow_id, next_pull FROM pull_schedule')
+        schedule = dict(self._cursor.fetchall())
+        due_shows = []
+        for tvshow_id in tvshow_ids:
+            next_pull = schedule.get(tvshow_id)
+            if next_pull is None or next_pull <= now:
+                heapq.heappush(due_shows, (next_pull or 0, tvshow_id))
+        return [heapq.heappop(due_shows)[1] for _ in range(len(due_shows))]
+
+    def upsert_show(self, tvshow_id, last_activity, next_pull):
+        # type: (int, Optional[int], int) -> None
+        self._cursor.execute("""
+            INSERT OR REPLACE INTO pull_schedule
+            (tvshow_id, last_activity, next_pull)
+            VALUES (?, ?, ?)
+        """, [tvshow_id, last_activity, next_pull])
+
+    def remove_show(self, tvshow_id):
+        # type: (int) -> None
+        self._cursor.execute('DELETE FROM pull_schedule WHERE tvshow_id = ?', [tvshow_id])
@@ -21,10 +21,7 @@ It is used to prevent extra push of a watched episode which has just been pulled
 """
 from __future__ import absolute_import, unicode_literals
 
-import os
-import sqlite3
-
-from .kodi_service import ADDON_PROFILE_DIR
+from .sqlite_db import SqliteDb, get_db_path
 
 try:
     from typing import Optional  # pylint: disable=unused-import
@@ -32,25 +29,16 @@ except ImportError:
     pass
 
 
-class PulledEpisodesDb(object):
-    DB = os.path.join(ADDON_PROFILE_DIR, 'pulled-episodes.sqlite')
-
-    def __init__(self):
-        self._connection = sqlite3.connect(self.DB)
-        self._cursor = self._connection.cursor()  # type: sqlite3.Cursor
-        self._cursor.execute("""
+class PulledEpisodesDb(SqliteDb):
+    DB = get_db_path('pulled-episodes.sqlite')
+    SCHEMA = (
+        """
             CREATE TABLE IF NOT EXISTS pulled_episodes(
                 episode_id INTEGER PRIMARY KEY,
                 timestamp INTEGER NOT NULL
             )
-        """)
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self._connection.commit()
-        self._connection.close()
+        """,
+    )
 
     def upsert_episode(self, episode_id):
         self._cursor.execute("""
@@ -72,11 +60,12 @@ class PulledEpisodesDb(object):
                 WHERE episode_id = ?
             """, [episode_id])
 
-    def is_pulled(self, episode_id):
+    def is_pulled(self, episode_id, timestamp=None):
+        # type: (int, Optional[int]) -> bool
         self._cursor.execute("""
             SELECT 1
             FROM pulled_episodes
-            WHERE episode_id = ? AND STRFTIME('%s', 'now') - timestamp < 10
-        """, [episode_id])
+            WHERE episode_id = ? AND COALESCE(?, STRFTIME('%s', 'now')) - timestamp < 10
+        """, [episode_id, timestamp])
         row = self._cursor.fetchone()
         return bool(row)
@@ -0,0 +1,180 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Reconcile episode statuses between Kodi and TVmaze"""
+# pylint: disable=missing-docstring
+from __future__ import absolute_import, unicode_literals
+
+from collections import defaultdict, namedtuple
+
+from .episode_records import StatusType
+
+try:
+    # pylint: disable=unused-import
+    from typing import Text, Dict, Any, List, Optional, Tuple
+    from .episode_records import EpisodeRecord
+except ImportError:
+    pass
+
+# pylint: disable=invalid-name
+KodiUpdate = namedtuple('KodiUpdate', ['episodeid', 'marked_at', 'playcount'])
+ReconciliationResult = namedtuple(
+    'ReconciliationResult', ['kodi_updates', 'episodes_by_id', 'episodes_by_numbering'])
+# pylint: enable=invalid-name
+
+
+class EpisodeIndex(object):
+    """Look up Kodi episode records by TVmaze episode info"""
+
+    def __init__(self, episode_records):
+        # type: (List[EpisodeRecord]) -> None
+        self._by_tvmaze_id = defaultdict(list)  # type: Dict[int, List[EpisodeRecord]]
+        self._by_numbering = defaultdict(list)  # type: Dict[Tuple[int, int], List[EpisodeRecord]]
+        self._by_airdate = defaultdict(list)  # type: Dict[Tuple[int, Text], List[EpisodeRecord]]
+        for record in episode_records:
+            if record.tvmaze_id is not None:
+                self._by_tvmaze_id[record.tvmaze_id].append(record)
+                continue
+            if record.has_numbering:
+                self._by_numbering[(record.season, record.episode)].append(record)
+            if record.firstaired:
+                self._by_airdate[(record.season, record.firstaired)].append(record)
+
+    def find_all(self, tvmaze_episode):
+        # type: (Dict[Text, Any]) -> List[EpisodeRecord]
+        """
+        Find Kodi episodes for an item of TVmaze watchlist
+
+        Several Kodi episodes can match one TVmaze episode if the library
+        has several Kodi TV shows for the same TVmaze show.
+
+        :param tvmaze_episode: watchlist item with embedded episode info
+        :return: the list of Kodi episode records
+        """
+        records = list(self._by_tvmaze_id.get(tvmaze_episode.get('episode_id'), []))
+        episode_info = tvmaze_episode.get('_embedded', {}).get('episode')
+        if not episode_info:
+            return records
+        if episode_info.get('type') == 'insignificant_special':
+            season = 0
+        else:
+            season = episode_info.get('season')
+        if episode_info.get('number') is not None:
+            records += self._by_numbering.get((season, episode_info['number']), [])
+        else:
+            # Specials without numbers are matched by their airdate
+            records += self._by_airdate.get((season, episode_info.get('airdate')), [])
+        return records
+
+    def find(self, tvmaze_episode):
+        # type: (Dict[Text, Any]) -> Optional[EpisodeRecord]
+        """
+        Find a Kodi episode for an item of TVmaze watchlist
+
+        :param tvmaze_episode: watchlist item with embedded episode info
+        :return: Kodi episode record or ``None`` if the episode is not in Kodi
+        """
+        records = self.find_all(tvmaze_episode)
+        return records[0] if records else None
+
+
+def merge_episode_records(episode_records):
+    # type: (List[EpisodeRecord]) -> List[EpisodeRecord]
+    """
+    Merge records that refer to the same TVmaze episode
+
+    A watched record wins over a non-watched one, and among records
+    with the same status the most recently marked one wins.
+
+    :param episode_records: episode records to push to TVmaze
+    :return: the list of unique episode records
+    """
+    merged = {}  # type: Dict[Tuple[Any, ...], EpisodeRecord]
+    for record in episode_records:
+        if record.tvmaze_id is not None:
+            key = (record.tvmaze_id,)  # type: Tuple[Any, ...]
+        else:
+            key = (None, record.season, record.episode)
+        current = merged.get(key)
+        if current is None or ((record.is_watched, record.marked_at)
+                               > (current.is_watched, current.marked_at)):
+            merged[key] = record
+    return list(merged.values())
+
+
+def _is_tvmaze_status_newer(record, tvmaze_episode):
+    # type: (EpisodeRecord, Dict[Text, Any]) -> bool
+    """
+    Check if TVmaze episode status has been set later than Kodi one
+
+    Kodi clears the last played time when an episode is marked as unwatched,
+    so only a watched Kodi status has a reliable time. On equal times
+    or if the time is unknown a watched status wins.
+    """
+    marked_at = tvmaze_episode.get('marked_at')
+    if not record.is_watched or marked_at is None or marked_at == record.marked_at:
+        return tvmaze_episode.get('type') == StatusType.WATCHED
+    return marked_at > record.marked_at
+
+
+def reconcile_episodes(episode_records, tvmaze_episodes, pull=True):
+    # type: (List[EpisodeRecord], List[Dict[Text, Any]], bool) -> ReconciliationResult
+    """
+    Compute the writes needed to bring Kodi and TVmaze episode statuses in sync
+
+    If the statuses differ, the one set later wins: TVmaze ``marked_at``
+    is compared with Kodi ``lastplayed`` of watched episodes, so an episode
+    unwatched on TVmaze after it has been played in Kodi is unwatched in Kodi too.
+    Unwatched Kodi episodes have no status time and lose to a TVmaze watched status
+    (marking as unwatched in Kodi is pushed to TVmaze immediately by the library monitor).
+    A newer TVmaze status is applied to Kodi with ``marked_at`` as the last played time
+    only if ``pull`` is ``True``, otherwise Kodi episode status is pushed to TVmaze.
+    Episodes that already have the same status on both sides,
+    including episodes that have just been pulled, are not pushed back to TVmaze.
+
+    :param episode_records: Kodi episodes of a TV show
+    :param tvmaze_episodes: TVmaze watchlist items of the same show with embedded episodes
+    :param pull: apply watched statuses from TVmaze to Kodi
+    :return: the named tuple of Kodi updates and episode records to push to TVmaze
+        by TVmaze IDs and by season/episode numbering
+    """
+    index = EpisodeIndex(episode_records)
+    tvmaze_statuses = {}  # type: Dict[int, Dict[Text, Any]]
+    kodi_updates = []
+    for tvmaze_episode in tvmaze_episodes:
+        for record in index.find_all(tvmaze_episode):
+            if record.tvmaze_id is None and tvmaze_episode.get('episode_id') is not None:
+                record.tvmaze_id = int(tvmaze_episode['episode_id'])
+            tvmaze_statuses[record.episodeid] = tvmaze_episode
+    episodes_by_id = []
+    episodes_by_numbering = []
+    for record in episode_records:
+        tvmaze_episode = tvmaze_statuses.get(record.episodeid)
+        if tvmaze_episode is not None:
+            tvmaze_type = tvmaze_episode.get('type')
+            if tvmaze_type == record.type or (tvmaze_type == StatusType.SKIPPED
+                                              and not record.is_watched):
+                continue
+            if pull and _is_tvmaze_status_newer(record, tvmaze_episode):
+                kodi_updates.append(KodiUpdate(record.episodeid, tvmaze_episode.get('marked_at'),
+                                               int(tvmaze_type == StatusType.WATCHED)))
+                continue
+        if record.tvmaze_id is not None:
+            episodes_by_id.append(record)
+        elif record.has_numbering:
+            episodes_by_numbering.append(record)
+    return ReconciliationResult(kodi_updates, episodes_by_id, episodes_by_numbering)
@@ -18,36 +18,268 @@
 
 from __future__ import absolute_import, unicode_literals
 
-from datetime import datetime, timedelta
+import abc
+import random
+import threading
+import time
+from datetime import datetime
 
-import xbmc
+import six
 
+from .episode_push import has_deferred_episodes, push_deferred_episodes
+from .kodi_compat import xbmc
 from .kodi_service import ADDON, logger
-from .scrobbling_service import pull_watched_episodes
+from .scrobbling_service import EpisodeIdBackfill, pull_watched_episodes_by_priority
+from .tvmaze_api import CIRCUIT_BREAKER, is_authorized
+from .work_queue import Priority, submit
+
+try:
+    from typing import Optional, List, Set, Text  # pylint: disable=unused-import
+except ImportError:
+    pass
 
 TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+MIN_SLEEP_SECONDS = 1.0
+MAX_SLEEP_SECONDS = 60.0
 
 
-def _should_pull():
-    pull_enabled = ADDON.getSettingBool('periodic_pull')
-    pull_during_playback = ADDON.getSettingBool('pull_during_playback')
-    player_has_media = xbmc.getCondVisibility('Player.HasMedia')
-    return pull_enabled and (not player_has_media or pull_during_playback)
+@six.add_metaclass(abc.ABCMeta)
+class ScheduledTask(object):
+    """
+    Base class for tasks run by :class:`TaskScheduler`
 
+    Task settings are cached and re-read only by :meth:`refresh_settings`
+    that the scheduler calls when addon settings are changed.
+    """
+    name = ''
+    jitter_seconds = 0.0
+    retry_seconds = 60.0
 
-def periodic_pull():
-    if _should_pull():
-        now = datetime.now()
+    def __init__(self):
+        # type: () -> None
+        self.next_run_time = None  # type: Optional[float]
+
+    @abc.abstractmethod
+    def refresh_settings(self):
+        # type: () -> None
+        """Re-read task settings and re-calculate the next run time"""
+
+    def can_run(self):
+        # type: () -> bool
+        """Check run-time conditions when the task is due"""
+        return True
+
+    @abc.abstractmethod
+    def run(self):
+        # type: () -> None
+        """Run the task and schedule the next run"""
+
+    def _schedule(self, timestamp):
+        # type: (Optional[float]) -> None
+        if timestamp is not None and self.jitter_seconds:
+            timestamp += random.uniform(0, self.jitter_seconds)
+        self.next_run_time = timestamp
+
+
+class PeriodicPullTask(ScheduledTask):
+    """
+    Pull watched episodes from TVmaze with the interval set in addon settings
+
+    On each run only TV shows that are due according to their activity are pulled.
+    """
+    name = 'periodic_pull'
+    jitter_seconds = 60.0
+
+    def __init__(self):
+        # type: () -> None
+        super(PeriodicPullTask, self).__init__()
+        self._pull_during_playback = False
+        self._interval_seconds = None  # type: Optional[float]
+
+    def refresh_settings(self):
+        # type: () -> None
+        self._interval_seconds = None
+        if not ADDON.getSettingBool('periodic_pull'):
+            self._schedule(None)
+            return
         pull_interval_hours_str = ADDON.getSettingString('pull_interval_hours')
         if not pull_interval_hours_str:
             logger.error('Pulling interval is not set')
+            self._schedule(None)
             return
-        pull_interval_hours = int(pull_interval_hours_str)
+        self._interval_seconds = int(pull_interval_hours_str) * 3600.0
+        self._pull_during_playback = ADDON.getSettingBool('pull_during_playback')
         time_last_pulled_str = ADDON.getSettingString('time_last_pulled')
-        time_last_pulled = (datetime.strptime(time_last_pulled_str, TIME_FORMAT)
-                            if time_last_pulled_str else None)
-        if (time_last_pulled is None
-                or now - timedelta(hours=pull_interval_hours) > time_last_pulled):
-            pull_watched_episodes()
-            ADDON.setSettingString('time_last_pulled', now.strftime(TIME_FORMAT))
-            logger.info('Pulled watched episodes from TVmaze')
+        if time_last_pulled_str:
+            time_last_pulled = time.mktime(
+                datetime.strptime(time_last_pulled_str, TIME_FORMAT).timetuple())
+            self._schedule(time_last_pulled + self._interval_seconds)
+        else:
+            self._schedule(time.time())
+
+    def can_run(self):
+        # type: () -> bool
+        if CIRCUIT_BREAKER.is_open:
+            return False
+        return self._pull_during_playback or not xbmc.getCondVisibility('Player.HasMedia')
+
+    def run(self):
+        # type: () -> None
+        interval_seconds = self._interval_seconds
+        if interval_seconds is None:
+            return  # Periodic pull has been disabled after the job was queued
+        now = datetime.now()
+        pull_watched_episodes_by_priority(int(interval_seconds))
+        if CIRCUIT_BREAKER.is_open:
+            logger.info('Periodic pull is postponed until TVmaze API is available')
+            self._schedule(CIRCUIT_BREAKER.retry_time)
+            return
+        ADDON.setSettingString('time_last_pulled', now.strftime(TIME_FORMAT))
+        logger.info('Pulled watched episodes from TVmaze')
+        if self._interval_seconds is not None:
+            self._schedule(time.mktime(now.timetuple()) + self._interval_seconds)
+
+
+class EpisodeIdBackfillTask(ScheduledTask):
+    """
+    Store TVmaze episode IDs in Kodi episodes in throttled chunks
+
+    Chunks are processed with a pause between them until all episodes
+    that can be resolved are updated, then the task is repeated daily
+    to pick up new episodes. The task can be disabled in addon settings.
+    """
+    name = 'episode_id_backfill'
+    jitter_seconds = 30.0
+    start_delay_seconds = 300.0
+    chunk_interval_seconds = 60.0
+    repeat_interval_seconds = 24 * 3600.0
+
+    def __init__(self):
+        # type: () -> None
+        super(EpisodeIdBackfillTask, self).__init__()
+        self._backfill = EpisodeIdBackfill()
+
+    def refresh_settings(self):
+        # type: () -> None
+        if not ADDON.getSettingBool('backfill_episode_ids'):
+            self._schedule(None)
+            return
+        if self.next_run_time is None:
+            self._schedule(time.time() + self.start_delay_seconds)
+
+    def can_run(self):
+        # type: () -> bool
+        return (is_authorized() and not CIRCUIT_BREAKER.is_open
+                and not xbmc.getCondVisibility('Player.HasMedia'))
+
+    def run(self):
+        # type: () -> None
+        if self._backfill.run_chunk():
+            self._schedule(time.time() + self.repeat_interval_seconds)
+        else:
+            self._schedule(time.time() + self.chunk_interval_seconds)
+
+
+class DeferredPushTask(ScheduledTask):
+    """
+    Push episodes that were deferred during TVmaze outage
+
+    The task checks for deferred episodes periodically and runs
+    when TVmaze API circuit breaker allows calls.
+    """
+    name = 'deferred_push'
+    check_interval_seconds = 60.0
+
+    def refresh_settings(self):
+        # type: () -> None
+        if self.next_run_time is None:
+            self._schedule(time.time() + self.check_interval_seconds)
+
+    def can_run(self):
+        # type: () -> bool
+        return has_deferred_episodes() and not CIRCUIT_BREAKER.is_open
+
+    def run(self):
+        # type: () -> None
+        push_deferred_episodes()
+        self._schedule(time.time() + self.check_interval_seconds)
+
+
+class TaskScheduler(object):
+    """
+    Run scheduled tasks when they are due
+
+    Between tasks the scheduler sleeps until the nearest due time
+    (but no longer than :const:`MAX_SLEEP_SECONDS` to pick up settings changes)
+    instead of polling on a short fixed interval. Due tasks are run
+    in the work queue with background priority, so the service thread
+    stays free to receive Kodi notifications.
+    """
+
+    def __init__(self, tasks):
+        # type: (List[ScheduledTask]) -> None
+        self._tasks = tasks
+        self._settings_changed = True
+        self._running_tasks = set()  # type: Set[Text]
+        self._lock = threading.Lock()
+
+    def on_settings_changed(self):
+        # type: () -> None
+        """Mark cached task settings as outdated"""
+        self._settings_changed = True
+
+    def _refresh_settings(self):
+        # type: () -> None
+        self._settings_changed = False
+        for task in self._tasks:
+            task.refresh_settings()
+            logger.debug('Task "{}" is scheduled at {}'.format(task.name, task.next_run_time))
+
+    def _run_task(self, task):
+        # type: (ScheduledTask) -> None
+        try:
+            task.run()
+        except Exception:
+            task.next_run_time = time.time() + task.retry_seconds
+            raise
+        finally:
+            with self._lock:
+                self._running_tasks.discard(task.name)
+
+    def _run_due_tasks(self):
+        # type: () -> None
+        now = time.time()
+        for task in self._tasks:
+            if task.next_run_time is None or task.next_run_time > now:
+                continue
+            with self._lock:
+                if task.name in self._running_tasks:
+                    continue
+            if task.can_run():
+                with self._lock:
+                    self._running_tasks.add(task.name)
+                task.next_run_time = None
+                submit(Priority.BACKGROUND, self._run_task, task)
+            else:
+                task.next_run_time = now + task.retry_seconds
+
+    def _get_sleep_time(self):
+        # type: () -> float
+        due_times = [task.next_run_time for task in self._tasks if task.next_run_time is not None]
+        if not due_times:
+            return MAX_SLEEP_SECONDS
+        return min(max(min(due_times) - time.time(), MIN_SLEEP_SECONDS), MAX_SLEEP_SECONDS)
+
+    def run(self, monitor):
+        # type: (xbmc.Monitor) -> None
+        """
+        Run the scheduler loop until Kodi requests abort
+
+        :param monitor: Kodi monitor instance
+        """
+        while True:
+            if self._settings_changed:
+                self._refresh_settings()
+            self._run_due_tasks()
+            if monitor.waitForAbort(self._get_sleep_time()):
+                break
@@ -20,42 +20,57 @@ from __future__ import absolute_import, division, unicode_literals
 
 import os
 import re
+import threading
 import time
 import uuid
 from collections import defaultdict, namedtuple
+from functools import partial
 from pprint import pformat
 
-import pyqrcode
 import six
-from kodi_six import xbmc
+from six.moves import queue
 
 from . import gui, medialibrary_api as medialib, tvmaze_api as tvmaze, kodi_service as kodi
+from .episode_links_db import EpisodeLinksDb
+from .episode_push import (create_episode_records, get_tvmaze_id, handle_authentication_error,
+                           link_episode_records, load_episode_catalog, notify_sync_completed,
+                           push_changed_episodes, push_episode_records, push_kodi_episodes)
+from .episode_records import EpisodeRecord, StatusType
+from .kodi_compat import xbmc
 from .kodi_service import logger
+from .pull_schedule_db import PullScheduleDb, get_pull_interval
 from .pulled_episodes_db import PulledEpisodesDb
-from .time_utils import timestamp_to_time_string, time_string_to_timestamp
+from .reconciliation import EpisodeIndex, KodiUpdate, reconcile_episodes
+from .time_utils import time_string_to_timestamp, timestamps_to_time_strings
+from .work_queue import Priority, submit, yield_to_higher_priority
 
 try:
     # pylint: disable=unused-import
-    from typing import Text, Dict, Any, List, Tuple, Callable, Optional, Union
+    from typing import (Text, Dict, Any, List, Tuple, Callable, Optional, Union, Generator,
+                        Iterable, Set)
 except ImportError:
     pass
 
 _ = kodi.GETTEXT
 
-SUPPORTED_IDS = ('tvmaze', 'tvdb', 'imdb')
+PIPELINE_QUEUE_SIZE = 4
+BACKFILL_CHUNK_SIZE = 100
+MAX_BACKFILL_FAILURES = 3
+SYNC_EPISODE_PROPERTIES = ['season', 'episode', 'playcount', 'tvshowid', 'uniqueid',
+                           'dateadded', 'lastplayed', 'firstaired']
 
-UniqueId = namedtuple('UniqueId', ['show_id', 'provider'])  # pylint: disable=invalid-name
-
-
-class StatusType(object):  # pylint: disable=too-few-public-methods
-    """Episode statuses on TVmaze"""
-    WATCHED = 0
-    ACQUIRED = 1
+# pylint: disable=invalid-name
+PullResult = namedtuple('PullResult', ['tvmaze_shows', 'skipped_count', 'skipped_show_ids'])
+PreparedShow = namedtuple(
+    'PreparedShow', ['show', 'tvmaze_id', 'episodes', 'tvmaze_episodes', 'error'])
+# pylint: enable=invalid-name
 
 
 def _create_and_save_qrcode(string):
     # type: (Text) -> Text
     """Create a QR-code from a string and save it to the addon profile directory"""
+    # The headless runner has no authorization dialog and does not need pyqrcode
+    import pyqrcode  # pylint: disable=import-outside-toplevel
     qrcode_image = pyqrcode.create(string)
     qrcode_filename = uuid.uuid4().hex + '.png'
     qrcode_path = os.path.join(kodi.ADDON_PROFILE_DIR, qrcode_filename)
@@ -117,165 +132,118 @@ def reset_authorization():
         tvmaze.clear_credentials()
 
 
-def _handle_authentication_error():
-    # type: () -> None
-    tvmaze.clear_credentials()
-    gui.DIALOG.notification(kodi.ADDON_NAME,
-                            _('Authentication failed. You need to authorize the addon.'),
-                            icon='error')
-
-
-def _get_unique_id(uniqueid_dict):
-    # type: (Dict[Text, Text]) -> Optional[UniqueId]
-    """
-    Get a show ID in one of the supported online databases
-
-    :param uniqueid_dict: uniqueid dict from Kodi JSON-RPC API
-    :return: a named tuple of unique ID and online data provider
-    """
-    for provider in SUPPORTED_IDS:
-        show_id = uniqueid_dict.get(provider)
-        if show_id is not None:
-            if provider == 'tvdb':
-                provider = 'thetvdb'
-            return UniqueId(show_id, provider)
-    return None
-
-
-def _prepare_episode_lists(kodi_episode_list):
-    # type: (List[Dict[Text, Any]]) -> Tuple[List[Dict[Text, int]], List[Dict[Text, int]]]
-    episodes_by_id = []
-    episodes_by_numbering = []
-    for episode in kodi_episode_list:
-        marked_at_sting = episode.get('lastplayed') or episode.get('dateadded')
-        if marked_at_sting:
-            marked_at = time_string_to_timestamp(marked_at_sting)
-        else:
-            marked_at = int(time.time())
-        scrobbling_info = {
-            'type': StatusType.WATCHED if episode['playcount'] else StatusType.ACQUIRED,
-            'marked_at': marked_at,
-        }
-        if episode.get('uniqueid') and 'tvmaze' in episode['uniqueid']:
-            scrobbling_info['episode_id'] = int(episode['uniqueid']['tvmaze'])
-            episodes_by_id.append(scrobbling_info)
-        elif episode['season'] and episode['episode']:
-            scrobbling_info['season'] = episode['season']
-            scrobbling_info['episode'] = episode['episode']
-            episodes_by_numbering.append(scrobbling_info)
-        else:
-            logger.error('Unable to scrobble the episode: {}'.format(pformat(episode)))
-    return episodes_by_id, episodes_by_numbering
-
-
-def _load_and_store_tvmaze_id(show_id, provider, kodi_tvshowid):
-    # type: (Text, Text, int) -> Optional[int]
+def _get_tv_shows_from_kodi(properties=None):
+    # type: (Optional[List[Text]]) -> Optional[List[Dict[Text, Any]]]
     try:
-        show_info = tvmaze.get_show_info_by_external_id(show_id, provider)
-    except tvmaze.TvMazeApiError:
+        return medialib.get_tvshows(properties)
+    except medialib.NoDataError:
+        logger.warning('Medialibrary has no TV shows')
         return None
-    tvmaze_id = show_info['id']
-    medialib.set_show_uniqueid(kodi_tvshowid, tvmaze_id)
-    return tvmaze_id
 
 
-def _get_tvmaze_id(kodi_show_info):
-    # type: (Dict[Text, Any]) -> Optional[int]
-    uniqueid_dict = kodi_show_info['uniqueid']
-    unique_id = _get_unique_id(uniqueid_dict)
-    if unique_id is None:
-        return None
-    if unique_id.provider == 'tvmaze':
-        return int(unique_id.show_id)
-    return _load_and_store_tvmaze_id(unique_id.show_id, unique_id.provider,
-                                     kodi_show_info['tvshowid'])
-
+def _apply_kodi_updates(kodi_updates):
+    # type: (List[KodiUpdate]) -> None
+    """Set episodes as watched or unwatched in Kodi"""
+    if not kodi_updates:
+        return
+    with PulledEpisodesDb() as database:
+        for kodi_update in kodi_updates:
+            database.upsert_episode(kodi_update.episodeid)
+    last_played_strings = iter(timestamps_to_time_strings(
+        kodi_update.marked_at for kodi_update in kodi_updates
+        if kodi_update.marked_at is not None and kodi_update.playcount))
+    for kodi_update in kodi_updates:
+        last_played = (next(last_played_strings)
+                       if kodi_update.marked_at is not None and kodi_update.playcount else None)
+        medialib.set_episode_playcount(kodi_update.episodeid, kodi_update.playcount,
+                                       last_played=last_played,
+                                       original_playcount=int(not kodi_update.playcount))
+
+
+def _set_watched_episodes_in_kodi(kodi_tvshowid, tvmaze_episodes):
+    # type: (int, List[Dict[Text, Any]]) -> None
+    """
+    Set episodes watched on TVmaze as watched in Kodi
 
-def _get_tv_shows_from_kodi():
-    # type: () -> Optional[List[Dict[Text, Any]]]
+    Unwatched Kodi episodes of the show are requested once.
+    TVmaze episodes are found in Kodi via stored episode links
+    and the rest are matched locally and linked for subsequent pulls.
+    """
+    watched_episodes = [episode for episode in tvmaze_episodes
+                        if episode['type'] == StatusType.WATCHED]
+    if not watched_episodes:
+        return
+    with EpisodeLinksDb() as database:
+        links = database.get_kodi_episode_ids(kodi_tvshowid)
+    has_unlinked = any(episode.get('episode_id') not in links for episode in watched_episodes)
+    filter_ = {'field': 'playcount', 'operator': 'is', 'value': '0'}
     try:
-        return medialib.get_tvshows()
+        kodi_episodes = medialib.get_episodes(
+            kodi_tvshowid, filter_=filter_,
+            properties=SYNC_EPISODE_PROPERTIES if has_unlinked else ['playcount'])
     except medialib.NoDataError:
-        logger.warning('Medialibrary has no TV shows')
-        return None
+        return
+    unwatched_ids = {episode['episodeid'] for episode in kodi_episodes}
+    index = EpisodeIndex(create_episode_records(kodi_episodes)) if has_unlinked else None
+    kodi_updates = {}  # type: Dict[int, KodiUpdate]
+    matched_records = []
+    for tvmaze_episode in watched_episodes:
+        kodi_episode_id = links.get(tvmaze_episode.get('episode_id'))
+        if kodi_episode_id is None and index is not None:
+            record = index.find(tvmaze_episode)
+            if record is not None:
+                if tvmaze_episode.get('episode_id') is not None:
+                    record.tvmaze_id = int(tvmaze_episode['episode_id'])
+                    matched_records.append(record)
+                kodi_episode_id = record.episodeid
+        if kodi_episode_id in unwatched_ids:
+            kodi_updates[kodi_episode_id] = KodiUpdate(kodi_episode_id,
+                                                       tvmaze_episode.get('marked_at'), 1)
+    link_episode_records(matched_records)
+    _apply_kodi_updates(list(kodi_updates.values()))
+
+
+def _is_fully_watched(kodi_show):
+    # type: (Dict[Text, Any]) -> bool
+    episode_count = kodi_show.get('episode')
+    return bool(episode_count) and kodi_show.get('watchedepisodes', 0) >= episode_count
 
 
-def _filter_by_firstaired(kodi_episodes, firstaired):
-    # type:(List[Dict[Text, Any]], Text) -> Optional[Dict[Text, Any]]
-    for episode in kodi_episodes:
-        if episode['firstaired'] == firstaired:
-            return episode
-    return None
-
-
-def _check_and_set_episode_playcount(kodi_tvshowid, tvmaze_episode):
-    # type: (int, Dict[Text, Any]) -> None
-    """Check episode watched status and set episode playcount in Kodi accordingly"""
-    tvmaze_episode_info = tvmaze_episode['_embedded']['episode']
-    if tvmaze_episode['type'] == StatusType.WATCHED:
-        if tvmaze_episode_info.get('type') == 'insignificant_special':
-            season = '0'
-        else:
-            season = str(tvmaze_episode_info['season'])
-        filter_ = {
-            'and': [
-                {
-                    'field': 'playcount',
-                    'operator': 'is',
-                    'value': '0',
-                },
-                {
-                    'field': 'season',
-                    'operator': 'is',
-                    'value': season,
-                },
-            ]
-        }
-        firstaired = None
-        if tvmaze_episode_info.get('number') is not None:
-            filter_['and'].append({
-                'field': 'episode',
-                'operator': 'is',
-                'value': str(tvmaze_episode_info['number']),
-            })
-        else:
-            firstaired = tvmaze_episode_info['airdate']
-        try:
-            kodi_episodes = medialib.get_episodes(kodi_tvshowid, filter_=filter_)
-        except medialib.NoDataError:
-            return
-        if kodi_episodes:
-            if firstaired is not None:
-                # A workaround because filtering by firstaired doesn't seem to work
-                kodi_episode_info = _filter_by_firstaired(kodi_episodes, firstaired)
-                if kodi_episode_info is None:
-                    return
-            else:
-                kodi_episode_info = kodi_episodes[0]
-            marked_at = tvmaze_episode.get('marked_at')
-            if marked_at is not None:
-                last_played = timestamp_to_time_string(marked_at)
-            else:
-                last_played = None
-            with PulledEpisodesDb() as database:
-                database.upsert_episode(kodi_episode_info['episodeid'])
-            medialib.set_episode_playcount(kodi_episode_info['episodeid'], last_played=last_played)
+def _pull_watched_episodes(kodi_tv_shows=None):
+    # type: (Optional[List[Dict[Text, Any]]]) -> Optional[PullResult]
+    """
+    Pull watched episodes from TVmaze and set them as watched in Kodi
 
+    TV shows that are already fully watched in Kodi are skipped.
 
-def _pull_watched_episodes(kodi_tv_shows=None):
-    # type: (Optional[List[Dict[Text, Any]]]) -> None
-    """Pull watched episodes from TVmaze and set them as watched in Kodi"""
+    :return: the named tuple of the dict of watched episodes from TVmaze by Kodi TV show IDs,
+        the number of skipped fully watched shows and Kodi IDs of fully watched shows
+        and shows without TVmaze ID or ``None`` if pulling has failed.
+    """
     logger.debug('Pulling watched episodes from TVmaze')
     with gui.background_progress_dialog(_('TVmaze Scrobbler'), _('Syncing episodes')) as dialog:
         kodi_tv_shows = kodi_tv_shows or _get_tv_shows_from_kodi()
         if not kodi_tv_shows:
-            return
+            return None
         tvmaze_shows = {}
+        watchlists = {}  # type: Dict[int, List[Dict[Text, Any]]]
+        skipped_count = 0
+        skipped_show_ids = []  # type: List[int]
         for show in kodi_tv_shows:
-            tvmaze_id = _get_tvmaze_id(show)
+            yield_to_higher_priority()
+            if _is_fully_watched(show):
+                skipped_count += 1
+                skipped_show_ids.append(show['tvshowid'])
+                continue
+            tvmaze_id = get_tvmaze_id(show)
             if tvmaze_id is None:
                 logger.error('Unable to determine TVmaze id from show info: {}'.format(
                     pformat(show)))
+                skipped_show_ids.append(show['tvshowid'])
+                continue
+            if tvmaze_id in watchlists:
+                # Several Kodi shows can have the same TVmaze ID
+                tvmaze_shows[show['tvshowid']] = watchlists[tvmaze_id]
                 continue
             try:
                 tvmaze_episodes = tvmaze.get_episodes_from_watchlist(tvmaze_id,
@@ -284,21 +252,39 @@ def _pull_watched_episodes(kodi_tv_shows=None):
                 logger.error('Unable to pull episodes from TVmaze for show "{}": {}'.format(
                     show['label'], exc
                 ))
+                if isinstance(exc, tvmaze.ServiceUnavailableError):
+                    return None
                 if six.text_type(exc) == tvmaze.AUTHENTICATION_ERROR:
-                    _handle_authentication_error()
-                    return
+                    handle_authentication_error()
+                    return None
                 continue
             logger.debug('Episodes from TVmaze for {}:\n{}'.format(
                 tvmaze_id, pformat(tvmaze_episodes)))
-            tvmaze_shows[show['tvshowid']] = tvmaze_episodes
+            tvmaze_shows[show['tvshowid']] = watchlists[tvmaze_id] = tvmaze_episodes
         shows_count = len(tvmaze_shows)
         for n, (tvshowid, tvmaze_episodes) in enumerate(six.iteritems(tvmaze_shows), 1):
+            yield_to_higher_priority()
             percent = int(100 * n / shows_count)
             dialog.update(percent,
                           _('TVmaze Scrobbler'),
                           _('Updating TV shows in Kodi: {} of {}').format(n, shows_count))
-            for episode in tvmaze_episodes:
-                _check_and_set_episode_playcount(tvshowid, episode)
+            _set_watched_episodes_in_kodi(tvshowid, tvmaze_episodes)
+    logger.info('Pulled watched episodes for {} TV shows, skipped {} fully watched shows'.format(
+        len(tvmaze_shows), skipped_count))
+    return PullResult(tvmaze_shows, skipped_count, skipped_show_ids)
+
+
+def _notify_pull_completed(pull_result):
+    # type: (PullResult) -> None
+    if not kodi.ADDON.getSettingBool('show_notifications'):
+        return
+    if pull_result.skipped_count:
+        message = _('Synced watched episodes from TVmaze. Skipped fully watched shows: {}').format(
+            pull_result.skipped_count)
+    else:
+        message = _('Synced watched episodes from TVmaze')
+    gui.DIALOG.notification(kodi.ADDON_NAME, message, icon=kodi.ADDON_ICON, time=3000,
+                            sound=False)
 
 
 def pull_watched_episodes():
@@ -306,65 +292,247 @@ def pull_watched_episodes():
     if not tvmaze.is_authorized():
         logger.warning('Addon is not authorized')
         return
-    _pull_watched_episodes()
-    if kodi.ADDON.getSettingBool('show_notifications'):
-        gui.DIALOG.notification(kodi.ADDON_NAME,
-                                _('Synced watched episodes from TVmaze'),
-                                icon=kodi.ADDON_ICON, time=3000, sound=False)
+    pull_result = _pull_watched_episodes()
+    if pull_result is not None:
+        _notify_pull_completed(pull_result)
 
 
-def _push_all_episodes(kodi_tv_shows):
-    # type: (List[Dict[Text, Any]]) -> None
-    """Push TV shows to TVmaze"""
-    logger.info('Pushing all episodes to TVmaze...')
-    success = True
-    with gui.background_progress_dialog(_('TVmaze Scrobbler'), _('Syncing episodes')) as dialog:
-        shows_count = len(kodi_tv_shows)
-        for n, show in enumerate(kodi_tv_shows, 1):
-            percent = int(100 * n / shows_count)
-            message = _(r'Syncing episodes for show \"{show_name}\": {count}/{total}').format(
-                show_name=show['label'],
-                count=n,
-                total=shows_count
-            )
-            dialog.update(percent, _('TVmaze Scrobbler'), message)
-            tvmaze_id = _get_tvmaze_id(show)
-            if tvmaze_id is None:
-                logger.error(
-                    'Unable to determine TVmaze id from show info: {}'.format(pformat(show)))
-                success = False
-                continue
+def _get_show_activity(kodi_show, tvmaze_episodes):
+    # type: (Dict[Text, Any], List[Dict[Text, Any]]) -> Optional[int]
+    """
+    Get the time of the latest activity for a TV show
+
+    The activity is the latest of: playback in Kodi, marking an episode
+    as watched on TVmaze and airing of a watched episode.
+
+    :return: POSIX timestamp or ``None`` if the show has no activity
+    """
+    activity_times = []
+    if kodi_show.get('lastplayed'):
+        activity_times.append(time_string_to_timestamp(kodi_show['lastplayed']))
+    for tvmaze_episode in tvmaze_episodes:
+        if tvmaze_episode.get('marked_at'):
+            activity_times.append(tvmaze_episode['marked_at'])
+        airdate = tvmaze_episode.get('_embedded', {}).get('episode', {}).get('airdate')
+        if airdate:
+            activity_times.append(time_string_to_timestamp(airdate + ' 00:00:00'))
+    return max(activity_times) if activity_times else None
+
+
+def pull_watched_episodes_by_priority(base_interval):
+    # type: (int) -> None
+    """
+    Pull watched episodes from TVmaze only for TV shows that are due
+
+    Recently active shows are pulled on every call while inactive
+    ones are pulled less often.
+
+    :param base_interval: pull interval for active shows in seconds
+    """
+    if not tvmaze.is_authorized():
+        logger.warning('Addon is not authorized')
+        return
+    kodi_tv_shows = _get_tv_shows_from_kodi(medialib.TVSHOW_PROPERTIES + ['lastplayed'])
+    if not kodi_tv_shows:
+        return
+    now = int(time.time())
+    shows_by_id = {show['tvshowid']: show for show in kodi_tv_shows}
+    with PullScheduleDb() as database:
+        due_show_ids = database.get_due_shows(shows_by_id, now)
+    logger.debug('{} of {} TV shows are due for pulling'.format(
+        len(due_show_ids), len(kodi_tv_shows)))
+    if not due_show_ids:
+        return
+    pull_result = _pull_watched_episodes([shows_by_id[show_id] for show_id in due_show_ids])
+    if pull_result is None:
+        return
+    with PullScheduleDb() as database:
+        for tvshowid, tvmaze_episodes in six.iteritems(pull_result.tvmaze_shows):
+            last_activity = _get_show_activity(shows_by_id[tvshowid], tvmaze_episodes)
+            interval = get_pull_interval(last_activity, base_interval, now)
+            database.upsert_show(tvshowid, last_activity, now + interval)
+        # Fully watched shows and shows without TVmaze ID are re-checked least often
+        for tvshowid in pull_result.skipped_show_ids:
+            database.upsert_show(tvshowid, None, now + get_pull_interval(None, base_interval, now))
+    _notify_pull_completed(pull_result)
+
+
+class ShowEpisodesProducer(threading.Thread):
+    """
+    Read and prepare episodes of TV shows from Kodi and TVmaze in a background thread
+
+    Episodes are read with library-wide paged JSON-RPC calls and grouped
+    by TV show on the fly. Several Kodi shows with the same TVmaze ID
+    are merged into one prepared show. Prepared shows are put into a bounded
+    queue so that reading episodes for the next show overlaps with writing
+    the previous show to Kodi and TVmaze.
+    """
+
+    def __init__(self, kodi_tv_shows, queue_size=PIPELINE_QUEUE_SIZE):
+        # type: (List[Dict[Text, Any]], int) -> None
+        super(ShowEpisodesProducer, self).__init__()
+        self.daemon = True
+        self._kodi_tv_shows = kodi_tv_shows
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+
+    def _put(self, item):
+        # type: (Any) -> bool
+        while not self.stop_event.is_set():
             try:
-                episodes = medialib.get_episodes(show['tvshowid'])
-            except medialib.NoDataError:
-                logger.warning('TV show "{}" has no episodes'.format(show['label']))
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
                 continue
-            episodes_by_id, episodes_by_numbering = _prepare_episode_lists(episodes)
-            try:
-                if episodes_by_id:
-                    tvmaze.push_episodes_by_id(episodes_by_id)
-                if episodes_by_numbering:
-                    tvmaze.push_episodes_by_show_id(episodes, tvmaze_id)
-            except tvmaze.TvMazeApiError as exc:
-                logger.error(
-                    'Unable to push episodes for show "{}": {}'.format(show['label'], exc))
-                if six.text_type(exc) == tvmaze.AUTHENTICATION_ERROR:
-                    _handle_authentication_error()
-                    return
-                success = False
+        return False
+
+    @staticmethod
+    def _prepare_show(show, tvmaze_id, episode_records):
+        # type: (Dict[Text, Any], int, List[EpisodeRecord]) -> PreparedShow
+        try:
+            tvmaze_episodes = tvmaze.get_episodes_from_watchlist(tvmaze_id)
+        except tvmaze.TvMazeApiError as exc:
+            return PreparedShow(show, tvmaze_id, None, None, exc)
+        return PreparedShow(show, tvmaze_id, episode_records, tvmaze_episodes, None)
+
+    def _produce(self):
+        # type: () -> bool
+        shows_by_id = {show['tvshowid']: show for show in self._kodi_tv_shows}
+        tvmaze_ids = {}  # type: Dict[int, int]
+        group_sizes = defaultdict(int)  # type: Dict[int, int]
+        for show in self._kodi_tv_shows:
+            tvmaze_id = get_tvmaze_id(show)
+            if tvmaze_id is None:
+                if not self._put(PreparedShow(show, None, None, None, None)):
+                    return False
                 continue
-    if success and kodi.ADDON.getSettingBool('show_notifications'):
-        gui.DIALOG.notification(kodi.ADDON_NAME, _('Sync completed'), icon=kodi.ADDON_ICON,
-                                time=3000, sound=False)
-    else:
-        gui.DIALOG.notification(kodi.ADDON_NAME,
-                                _('Sync completed with errors. Check the log for more info.'),
-                                icon='warning')
+            tvmaze_ids[show['tvshowid']] = tvmaze_id
+            group_sizes[tvmaze_id] += 1
+        # Episodes of Kodi shows with the same TVmaze ID are merged
+        # and synced once after all the shows have been read
+        groups = {}  # type: Dict[int, Tuple[Dict[Text, Any], set, List[EpisodeRecord]]]
+        read_show_ids = set()  # type: Set[int]
+        for tvshowid, episodes in medialib.iter_episodes_by_tvshow(SYNC_EPISODE_PROPERTIES):
+            tvmaze_id = tvmaze_ids.get(tvshowid)
+            if tvmaze_id is None:
+                continue
+            read_show_ids.add(tvshowid)
+            show = shows_by_id[tvshowid]
+            episode_records = create_episode_records(episodes)
+            if group_sizes[tvmaze_id] > 1:
+                show, seen_show_ids, group_records = groups.setdefault(
+                    tvmaze_id, (show, set(), []))
+                seen_show_ids.add(tvshowid)
+                group_records.extend(episode_records)
+                if len(seen_show_ids) < group_sizes[tvmaze_id]:
+                    continue
+                del groups[tvmaze_id]
+                episode_records = group_records
+            if not self._put(self._prepare_show(show, tvmaze_id, episode_records)):
+                return False
+        for tvmaze_id, (show, _seen_show_ids, group_records) in six.iteritems(groups):
+            if not self._put(self._prepare_show(show, tvmaze_id, group_records)):
+                return False
+        for tvshowid in set(tvmaze_ids).difference(read_show_ids):
+            logger.warning('TV show "{}" has no episodes'.format(shows_by_id[tvshowid]['label']))
+        return True
+
+    def run(self):
+        try:
+            if not self._produce():
+                return
+        except Exception as exc:  # pylint: disable=broad-except
+            self._put(exc)
+            return
+        self._put(None)
+
+    def __iter__(self):
+        # type: () -> Generator[PreparedShow, None, None]
+        """
+        Iterate over prepared shows
+
+        :raises Exception: re-raises an exception that has happened in the producer thread
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def stop(self):
+        # type: () -> None
+        self.stop_event.set()
+        self.join()
+
+
+def _sync_all_episodes(kodi_tv_shows, pull=True):
+    # type: (List[Dict[Text, Any]], bool) -> None
+    """
+    Sync episodes of TV shows between Kodi and TVmaze
+
+    Episodes of each show are read from Kodi and TVmaze once
+    and only the differences are written to each side.
+
+    :param kodi_tv_shows: TV shows from Kodi
+    :param pull: apply watched statuses from TVmaze to Kodi
+    """
+    logger.info('Syncing all episodes with TVmaze...')
+    success = True
+    with gui.background_progress_dialog(_('TVmaze Scrobbler'), _('Syncing episodes')) as dialog:
+        shows_count = len(kodi_tv_shows)
+        producer = ShowEpisodesProducer(kodi_tv_shows)
+        producer.start()
+        try:
+            for n, prepared_show in enumerate(producer, 1):
+                yield_to_higher_priority()
+                show = prepared_show.show
+                percent = int(100 * n / shows_count)
+                message = _(r'Syncing episodes for show \"{show_name}\": {count}/{total}').format(
+                    show_name=show['label'],
+                    count=n,
+                    total=shows_count
+                )
+                dialog.update(percent, _('TVmaze Scrobbler'), message)
+                if prepared_show.tvmaze_id is None:
+                    logger.error(
+                        'Unable to determine TVmaze id from show info: {}'.format(pformat(show)))
+                    success = False
+                    continue
+                try:
+                    if prepared_show.error is not None:
+                        raise prepared_show.error
+                    result = reconcile_episodes(prepared_show.episodes,
+                                                prepared_show.tvmaze_episodes, pull)
+                    link_episode_records(prepared_show.episodes)
+                    logger.debug(
+                        'Show "{}": {} episodes to update in Kodi, {} episodes to push'.format(
+                            show['label'], len(result.kodi_updates),
+                            len(result.episodes_by_id) + len(result.episodes_by_numbering)))
+                    _apply_kodi_updates(result.kodi_updates)
+                    push_episode_records(result.episodes_by_id, result.episodes_by_numbering,
+                                          prepared_show.tvmaze_id)
+                except tvmaze.TvMazeApiError as exc:
+                    logger.error(
+                        'Unable to sync episodes for show "{}": {}'.format(show['label'], exc))
+                    if six.text_type(exc) == tvmaze.AUTHENTICATION_ERROR:
+                        handle_authentication_error()
+                        return
+                    success = False
+                    if isinstance(exc, tvmaze.ServiceUnavailableError):
+                        break
+                    continue
+        finally:
+            producer.stop()
+    logger.info('TVmaze API traffic since start:\n{}'.format(
+        tvmaze.TRAFFIC_STATS.format_summary()))
+    notify_sync_completed(success, error_icon='warning')
 
 
 def sync_all_episodes():
     # type: () -> None
-    """Pull watched episodes from TVmaze and then push all TV shows from Kodi to TVmaze"""
+    """Sync watched statuses of all TV shows between Kodi and TVmaze"""
     if not tvmaze.is_authorized():
         logger.warning('Addon is not authorized')
         return
@@ -373,86 +541,91 @@ def sync_all_episodes():
         gui.DIALOG.notification(kodi.ADDON_NAME, _('Medialibrary has no TV episodes'),
                                 icon='warning')
         return
-    if kodi.ADDON.getSettingBool('pull_from_tvmaze'):
-        _pull_watched_episodes(tv_shows)
-    _push_all_episodes(tv_shows)
+    _sync_all_episodes(tv_shows, pull=kodi.ADDON.getSettingBool('pull_from_tvmaze'))
 
 
-def push_single_episode(episode_id):
-    # type: (int) -> None
-    """Push watched status for a single episode"""
-    if not tvmaze.is_authorized():
-        logger.warning('Addon is not authorized')
-        return
-    logger.debug('Pushing single episode to TVmaze')
-    episode_info = medialib.get_episode_details(episode_id)
-    tvshow_info = medialib.get_tvshow_details(episode_info['tvshowid'])
-    tvmaze_id = _get_tvmaze_id(tvshow_info)
-    if tvmaze_id is None:
-        logger.error(
-            'Unable to determine TVmaze id from show info: {}'.format(pformat(tvshow_info)))
-        return
-    episodes_by_id, episodes_by_numbering = _prepare_episode_lists([episode_info])
-    try:
-        if episodes_by_id:
-            tvmaze.push_episodes_by_id(episodes_by_id)
-        if episodes_by_numbering:
-            tvmaze.push_episodes_by_show_id(episodes_by_numbering, tvmaze_id)
-    except tvmaze.TvMazeApiError as exc:
-        logger.error('Failed to push episode status: {}'.format(exc))
-        if six.text_type(exc) == tvmaze.AUTHENTICATION_ERROR:
-            _handle_authentication_error()
-        else:
-            gui.DIALOG.notification(kodi.ADDON_NAME,
-                                    _('Failed to sync episode status'),
-                                    icon='error')
-        return
-    if kodi.ADDON.getSettingBool('show_notifications'):
-        gui.DIALOG.notification(kodi.ADDON_NAME,
-                                _('Synced episode status'), icon=kodi.ADDON_ICON, time=3000,
-                                sound=False)
+class EpisodeIdBackfill(object):
+    """
+    Store TVmaze episode IDs in uniqueid of Kodi episodes chunk by chunk
+
+    Episodes with TVmaze IDs are pushed by IDs and matched
+    without extra lookups on subsequent syncs. The position in the library-wide
+    episode list is kept between chunks, so the library is paged through
+    once per pass. Episodes that have failed to update
+    :const:`MAX_BACKFILL_FAILURES` times are not retried.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self._start = 0
+        self._total_count = 0
+        self._covered_count = 0
+        self._failures = {}  # type: Dict[int, int]
+
+    @staticmethod
+    def _get_catalog(tvshowid, catalogs):
+        # type: (int, Dict[int, Dict[Tuple[int, int], int]]) -> Dict[Tuple[int, int], int]
+        if tvshowid not in catalogs:
+            tvmaze_id = get_tvmaze_id(medialib.TVSHOW_CACHE.get(tvshowid))
+            catalogs[tvshowid] = load_episode_catalog(tvmaze_id) if tvmaze_id is not None else {}
+        return catalogs[tvshowid]
+
+    def run_chunk(self, chunk_size=BACKFILL_CHUNK_SIZE):
+        # type: (int) -> bool
+        """
+        Update at most ``chunk_size`` episodes with a batch JSON-RPC request
+
+        :param chunk_size: max number of episodes to update
+        :return: ``True`` if the pass over the library has been completed
+        """
+        pending = []  # type: List[Tuple[int, int]]
+        catalogs = {}  # type: Dict[int, Dict[Tuple[int, int], int]]
+        position = self._start
+        is_completed = True
+        properties = ['season', 'episode', 'uniqueid', 'tvshowid']
+        for episode in medialib.iter_library_episodes(properties, start=self._start):
+            if len(pending) >= chunk_size:
+                is_completed = False
+                break
+            position += 1
+            self._total_count += 1
+            if 'tvmaze' in (episode.get('uniqueid') or {}):
+                self._covered_count += 1
+                continue
+            if self._failures.get(episode['episodeid'], 0) >= MAX_BACKFILL_FAILURES:
+                continue
+            catalog = self._get_catalog(episode['tvshowid'], catalogs)
+            tvmaze_episode_id = catalog.get((episode['season'], episode['episode']))
+            if tvmaze_episode_id is not None:
+                pending.append((episode['episodeid'], tvmaze_episode_id))
+        with PulledEpisodesDb() as database:
+            for episode_id, _tvmaze_episode_id in pending:
+                database.upsert_episode(episode_id)
+        results = medialib.set_episode_uniqueids(pending)
+        for (episode_id, _tvmaze_episode_id), result in zip(pending, results):
+            if result is None:
+                self._failures[episode_id] = self._failures.get(episode_id, 0) + 1
+            else:
+                self._covered_count += 1
+                self._failures.pop(episode_id, None)
+        if not is_completed:
+            self._start = position
+            return False
+        if self._total_count:
+            logger.info('TVmaze episode ID coverage: {:.1f}% ({} of {} episodes)'.format(
+                100.0 * self._covered_count / self._total_count, self._covered_count,
+                self._total_count))
+        self._start = self._total_count = self._covered_count = 0
+        return True
 
 
 def _push_recent_episodes(recent_episodes):
     # type: (List[Dict[Text, Any]]) -> None
     """Push recent episodes to TVmaze"""
     logger.debug('Pushing recent episodes to TVmaze')
-    success = True
-    id_mapping = {}
-    episode_mapping = defaultdict(list)
-    for episode in recent_episodes:
-        if episode['tvshowid'] not in id_mapping:
-            show_info = medialib.get_tvshow_details(episode['tvshowid'])
-            tvmaze_id = _get_tvmaze_id(show_info)
-            if tvmaze_id is None:
-                logger.error(
-                    'Unable to determine TVmaze id from show info: {}'.format(pformat(show_info)))
-                continue
-            id_mapping[episode['tvshowid']] = tvmaze_id
-            episode_mapping[tvmaze_id].append(episode)
-        else:
-            episode_mapping[id_mapping[episode['tvshowid']]].append(episode)
-    for tvmaze_id, episodes in six.iteritems(episode_mapping):
-        episodes_by_id, episodes_by_numbering = _prepare_episode_lists(episodes)
-        try:
-            if episodes_by_id:
-                tvmaze.push_episodes_by_id(episodes_by_id)
-            if episodes_by_numbering:
-                tvmaze.push_episodes_by_show_id(episodes_by_numbering, tvmaze_id)
-        except tvmaze.TvMazeApiError as exc:
-            logger.error('Unable to update episodes for show {}: {}'.format(tvmaze_id, exc))
-            if six.text_type(exc) == tvmaze.AUTHENTICATION_ERROR:
-                _handle_authentication_error()
-                return
-            success = False
-            continue
-    if success and kodi.ADDON.getSettingBool('show_notifications'):
-        gui.DIALOG.notification(kodi.ADDON_NAME, _('Sync completed'), icon=kodi.ADDON_ICON,
-                                time=3000, sound=False)
-    else:
-        gui.DIALOG.notification(kodi.ADDON_NAME,
-                                _('Sync completed with errors. Check the log for more info.'),
-                                icon='error')
+    push_result = push_kodi_episodes(recent_episodes)
+    if push_result is not None:
+        notify_sync_completed(push_result[1])
 
 
 def sync_recent_episodes(show_warning=True):
@@ -475,6 +648,48 @@ def sync_recent_episodes(show_warning=True):
     _push_recent_episodes(recent_episodes)
 
 
+def sync_changed_episodes():
+    # type: () -> None
+    """Pull watched episodes from TVmaze and then push changed episodes to TVmaze"""
+    if not tvmaze.is_authorized():
+        logger.warning('Addon is not authorized')
+        return
+    if kodi.ADDON.getSettingBool('pull_from_tvmaze'):
+        _pull_watched_episodes()
+    success = push_changed_episodes()
+    if success is not None:
+        notify_sync_completed(success)
+
+
+# Actions that are run by the service with the given priority
+SERVICE_ACTIONS = {
+    'sync_all_episodes': (Priority.BACKGROUND, sync_all_episodes),
+    'pull_watched_episodes': (Priority.BACKGROUND, pull_watched_episodes),
+    'sync_recent_episodes': (Priority.POST_SCAN, sync_recent_episodes),
+}
+
+
+def request_service_action(action):
+    # type: (Text) -> None
+    """
+    Ask the service to run an action
+
+    Actions are run in the service work queue so that manual syncs
+    do not compete with episodes that a user is watching.
+    """
+    medialib.send_json_rpc('JSONRPC.NotifyAll', {'sender': kodi.ADDON_ID, 'message': action})
+
+
+def run_service_action(action):
+    # type: (Text) -> None
+    """Add an action requested by :func:`request_service_action` to the work queue"""
+    if action not in SERVICE_ACTIONS:
+        logger.warning('Unknown service action: {}'.format(action))
+        return
+    priority, func = SERVICE_ACTIONS[action]
+    submit(priority, func)
+
+
 def get_menu_actions():
     # type: () -> List[Tuple[Text, Callable[[], None]]]
     """
@@ -485,9 +700,11 @@ def get_menu_actions():
     actions = [(_('Authorize the addon'), authorize_addon)]
     if tvmaze.is_authorized():
         actions = [
-            (_('Sync all shows'), sync_all_episodes),
-            (_('Sync recently added episodes'), sync_recent_episodes),
-            (_('Sync watched episodes from TVmaze'), pull_watched_episodes),
+            (_('Sync all shows'), partial(request_service_action, 'sync_all_episodes')),
+            (_('Sync recently added episodes'),
+             partial(request_service_action, 'sync_recent_episodes')),
+            (_('Sync watched episodes from TVmaze'),
+             partial(request_service_action, 'pull_watched_episodes')),
             (_('Reset Authorization'), reset_authorization),
         ] + actions
     return actions
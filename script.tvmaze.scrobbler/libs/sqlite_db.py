@@ -0,0 +1,59 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Base class for addon SQLite databases"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+import sqlite3
+
+from .kodi_service import ADDON_PROFILE_DIR
+
+try:
+    from typing import Text, Tuple  # pylint: disable=unused-import
+except ImportError:
+    pass
+
+
+def get_db_path(file_name):
+    # type: (Text) -> Text
+    """Get the path of a database file in the addon profile directory"""
+    return os.path.join(ADDON_PROFILE_DIR, file_name)
+
+
+class SqliteDb(object):
+    """
+    SQLite database context manager
+
+    Subclasses set the database file path in ``DB`` and the statements
+    that create the database tables and indexes in ``SCHEMA``.
+    Changes are committed when the context manager exits.
+    """
+    DB = ''  # type: Text
+    SCHEMA = ()  # type: Tuple[Text, ...]
+
+    def __init__(self):
+        self._connection = sqlite3.connect(self.DB)
+        self._cursor = self._connection.cursor()  # type: sqlite3.Cursor
+        for statement in self.SCHEMA:
+            self._cursor.execute(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._connection.commit()
+        self._connection.close()
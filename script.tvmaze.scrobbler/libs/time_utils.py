@@ -7,16 +7,19 @@ import time
 from dateutil import tz
 
 try:
-    from typing import Text  # pylint: disable=unused-import
+    from typing import Text, Iterable, List, Dict, Any, Callable  # pylint: disable=unused-import
 except ImportError:
     pass
 
 DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+CACHE_SIZE = 4096
 
 # Dummy call to overcome this bug:
 # https://stackoverflow.com/questions/16309650/python-importerror-for-strptime-in-spyder-for-windows-7
 _ = time.strptime('2021-01-01 00:00:00', DATETIME_FORMAT)
 
+LOCAL_TZ = tz.tzlocal()
+
 
 class proxydt(datetime.datetime):  # pylint: disable=invalid-name
     """
@@ -33,16 +36,74 @@ class proxydt(datetime.datetime):  # pylint: disable=invalid-name
 datetime.datetime = proxydt
 
 
+def _memoize(func):
+    # type: (Callable[[Any], Any]) -> Callable[[Any], Any]
+    """
+    Cache results of a single-argument function
+
+    The cache is bounded by :const:`CACHE_SIZE` items and is simply
+    cleared when it is full.
+    """
+    cache = {}  # type: Dict[Any, Any]
+
+    def wrapper(arg):
+        try:
+            return cache[arg]
+        except KeyError:
+            pass
+        if len(cache) >= CACHE_SIZE:
+            cache.clear()
+        result = cache[arg] = func(arg)
+        return result
+
+    wrapper.cache = cache
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def _parse_time_string(time_string):
+    # type: (Text) -> datetime.datetime
+    """
+    Parse a time string in fixed ``%Y-%m-%d %H:%M:%S`` format
+
+    Falls back to ``strptime`` if the string does not match the format exactly,
+    so malformed strings raise ``ValueError`` as before.
+    """
+    if (len(time_string) == 19 and time_string[4] == time_string[7] == '-'
+            and time_string[10] == ' ' and time_string[13] == time_string[16] == ':'):
+        try:
+            return datetime.datetime(int(time_string[0:4]), int(time_string[5:7]),
+                                     int(time_string[8:10]), int(time_string[11:13]),
+                                     int(time_string[14:16]), int(time_string[17:19]))
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(time_string, DATETIME_FORMAT)
+
+
+@_memoize
 def timestamp_to_time_string(posix_timestamp):
     # type: (int) -> Text
-    date_time = datetime.datetime.fromtimestamp(posix_timestamp, tz=tz.tzlocal())
+    date_time = datetime.datetime.fromtimestamp(posix_timestamp, tz=LOCAL_TZ)
     return date_time.strftime(DATETIME_FORMAT)
 
 
+@_memoize
 def time_string_to_timestamp(time_string):
     # type: (Text) -> int
-    time_object = datetime.datetime.strptime(time_string, DATETIME_FORMAT)
-    time_object = time_object.replace(tzinfo=tz.tzlocal())
+    time_object = _parse_time_string(time_string)
+    time_object = time_object.replace(tzinfo=LOCAL_TZ)
     timetuple = time_object.timetuple()
     timestamp = int(time.mktime(timetuple))
     return timestamp if timestamp >= 0 else 0
+
+
+def timestamps_to_time_strings(posix_timestamps):
+    # type: (Iterable[int]) -> List[Text]
+    """Convert a batch of POSIX timestamps to local time strings"""
+    return [timestamp_to_time_string(timestamp) for timestamp in posix_timestamps]
+
+
+def time_strings_to_timestamps(time_strings):
+    # type: (Iterable[Text]) -> List[int]
+    """Convert a batch of local time strings to POSIX timestamps"""
+    return [time_string_to_timestamp(time_string) for time_string in time_strings]
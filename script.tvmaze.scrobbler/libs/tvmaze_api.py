@@ -19,7 +19,11 @@
 
 from __future__ import absolute_import, unicode_literals
 
-from pprint import pformat
+import json
+import re
+import threading
+import time
+from collections import defaultdict
 
 import requests
 from six.moves import urllib_parse
@@ -27,7 +31,8 @@ from six.moves import urllib_parse
 from .kodi_service import logger, ADDON
 
 try:
-    from typing import Union, Text, List, Optional, Tuple, Dict, Any  # pylint: disable=unused-import
+    # pylint: disable=unused-import
+    from typing import Union, Text, List, Optional, Tuple, Dict, Any, Callable, Hashable
     DataType = Dict[Text, Any]  # pylint: disable=invalid-name
 except ImportError:
     pass
@@ -39,14 +44,106 @@ AUTH_POLL_PATH = '/auth/poll'
 SCROBBLE_SHOWS_PATH = '/scrobble/shows'
 SCROBBLE_EPISODES_PATH = '/scrobble/episodes'
 SHOW_LOOKUP_PATH = '/lookup/shows'
+SHOWS_PATH = '/shows'
 
 SESSION = requests.Session()
 SESSION.headers.update({
     'User-Agent': 'Kodi scrobbler for tvmaze.com',
     'Accept': 'application/json',
+    'Accept-Encoding': 'gzip, deflate',
 })
 
 AUTHENTICATION_ERROR = 'Invalid username or API key'
+REQUEST_TIMEOUT = 30.0
+MAX_LOGGED_BODY_LENGTH = 2000
+
+
+class SharedResponseCache(object):
+    """
+    Cache of TVmaze responses that is shared by several Kodi hosts
+
+    The cache is disabled by default so a single Kodi instance
+    always gets fresh responses.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self.enabled = False
+        self._responses = {}  # type: Dict[Hashable, Any]
+        self._lock = threading.Lock()
+
+    def get_or_call(self, key, func):
+        # type: (Hashable, Callable[[], Any]) -> Any
+        if not self.enabled:
+            return func()
+        with self._lock:
+            if key in self._responses:
+                return self._responses[key]
+        response = func()
+        with self._lock:
+            self._responses[key] = response
+        return response
+
+    def clear(self):
+        # type: () -> None
+        with self._lock:
+            self._responses.clear()
+
+
+class TrafficStats(object):
+    """
+    Count requests and transferred bytes per TVmaze API endpoint
+
+    Response sizes are taken from Content-Length header,
+    so compressed responses are counted by their size on the wire.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self._stats = defaultdict(lambda: [0, 0, 0])  # type: Dict[Text, List[int]]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_endpoint(method, url):
+        # type: (Text, Text) -> Text
+        path = url.replace(USER_API_URL, '').replace(API_URL, '')
+        return '{} {}'.format(method.upper(), re.sub(r'/\d+', '/{id}', path))
+
+    def add(self, endpoint, request_bytes, response_bytes):
+        # type: (Text, int, int) -> None
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats[0] += 1
+            stats[1] += request_bytes
+            stats[2] += response_bytes
+
+    def get_stats(self):
+        # type: () -> Dict[Text, Dict[Text, int]]
+        """Get (requests, sent bytes, received bytes) by endpoint"""
+        with self._lock:
+            return {
+                endpoint: {'requests': stats[0], 'sent': stats[1], 'received': stats[2]}
+                for endpoint, stats in self._stats.items()
+            }
+
+    def format_summary(self):
+        # type: () -> Text
+        lines = ['{}: {} requests, {} bytes sent, {} bytes received'.format(
+            endpoint, stats['requests'], stats['sent'], stats['received'])
+            for endpoint, stats in sorted(self.get_stats().items())]
+        return '\n'.join(lines)
+
+    def clear(self):
+        # type: () -> None
+        with self._lock:
+            self._stats.clear()
+
+
+TRAFFIC_STATS = TrafficStats()
+
+# Watchlists are cleared on every sync cycle while show lookups never change
+WATCHLIST_CACHE = SharedResponseCache()
+SHOW_LOOKUP_CACHE = SharedResponseCache()
 
 
 class TvMazeApiError(Exception):
@@ -82,6 +179,103 @@ class AuthorizationError(TvMazeApiError):
     pass
 
 
+class ServiceUnavailableError(TvMazeApiError):
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Stop calling TVmaze API during outages
+
+    The breaker opens after ``failure_threshold`` consecutive failures
+    and rejects calls for ``cooldown_seconds``. After that a single probe call
+    is allowed (half-open state): if it succeeds the breaker closes,
+    otherwise it opens for another cooling period.
+    Only request errors (connection errors, timeouts, broken responses, etc.)
+    and 5xx/429 responses count as failures.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, cooldown_seconds=300.0):
+        # type: (int, float) -> None
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._state = self.CLOSED
+        self._failure_count = 0
+        self._opened_at = None  # type: Optional[float]
+        self._lock = threading.Lock()
+
+    @property
+    def retry_time(self):
+        # type: () -> Optional[float]
+        """The time when calls are allowed again or ``None`` if the breaker is closed"""
+        if self._opened_at is None:
+            return None
+        return self._opened_at + self.cooldown_seconds
+
+    @property
+    def is_open(self):
+        # type: () -> bool
+        """Check if calls are rejected at the moment"""
+        if self._state == self.CLOSED:
+            return False
+        return self._state == self.HALF_OPEN or time.time() < self.retry_time
+
+    def before_call(self):
+        # type: () -> None
+        """
+        Check if a call is allowed
+
+        :raises ServiceUnavailableError: if the call is rejected
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN and time.time() >= self.retry_time:
+                logger.info('Probing TVmaze API availability')
+                self._state = self.HALF_OPEN
+                return
+        raise ServiceUnavailableError('TVmaze API is unavailable, retry after {}'.format(
+            time.strftime('%H:%M:%S', time.localtime(self.retry_time))))
+
+    def record_success(self):
+        # type: () -> None
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info('TVmaze API is available again')
+            self._state = self.CLOSED
+            self._failure_count = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        # type: () -> None
+        with self._lock:
+            self._failure_count += 1
+            if (self._state == self.HALF_OPEN
+                    or self._failure_count >= self.failure_threshold):
+                if self._state != self.OPEN:
+                    logger.warning(
+                        'TVmaze API failed {} times in a row, pausing calls for {:.0f}s'.format(
+                            self._failure_count, self.cooldown_seconds))
+                self._state = self.OPEN
+                self._opened_at = time.time()
+
+    def get_state(self):
+        # type: () -> Dict[Text, Any]
+        """Get breaker state for diagnostics"""
+        with self._lock:
+            return {
+                'state': self._state,
+                'failure_count': self._failure_count,
+                'retry_time': self.retry_time,
+            }
+
+
+CIRCUIT_BREAKER = CircuitBreaker()
+
+
 def _get_credentials():
     # type: () -> Tuple[Text, Text]
     username = ADDON.getSettingString('username')
@@ -100,6 +294,13 @@ def clear_credentials():
     ADDON.setSettingString('apikey', '')
 
 
+def _truncate(text):
+    # type: (Text) -> Text
+    if len(text) > MAX_LOGGED_BODY_LENGTH:
+        return '{}... ({} chars)'.format(text[:MAX_LOGGED_BODY_LENGTH], len(text))
+    return text
+
+
 def _send_request(url, method='get', **requests_kwargs):
     # type: (Text, Text, **Optional[Union[tuple, dict, list]]) -> requests.Response
     """
@@ -110,22 +311,40 @@ def _send_request(url, method='get', **requests_kwargs):
     :param requests_kwargs: kwagrs to be passed to a Requests call
     :return: Requests response object
     :raises requests.HTTPError:
+    :raises ServiceUnavailableError: if TVmaze API is not available
     """
     method_func = getattr(SESSION, method, SESSION.get)
     auth = requests_kwargs.pop('auth', None)  # Remove credentials before logging
     params = requests_kwargs.get('params')
     paramstring = '?{}'.format(urllib_parse.urlencode(params)) if params else ''
     logger.debug('Calling URL: {} {}{}'.format(method.upper(), url, paramstring))
-    if method == 'post':
-        logger.debug('POST payload: {}'.format(pformat(requests_kwargs.get('json'))))
-    response = method_func(url, auth=auth, verify=False, **requests_kwargs)
+    payload = requests_kwargs.pop('json', None)
+    if payload is not None:
+        # Compact separators make scrobble payloads about 15% smaller
+        requests_kwargs['data'] = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        requests_kwargs['headers'] = {'Content-Type': 'application/json'}
+        logger.debug('{} payload: {}'.format(
+            method.upper(), _truncate(requests_kwargs['data'].decode('utf-8'))))
+    requests_kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+    CIRCUIT_BREAKER.before_call()
+    is_available = False
+    try:
+        response = method_func(url, auth=auth, verify=False, **requests_kwargs)
+        is_available = response.status_code < 500 and response.status_code != 429
+    except requests.RequestException as exc:
+        raise ServiceUnavailableError('Unable to connect to TVmaze API: {}'.format(exc))
+    finally:
+        # Any outcome must be recorded, or a half-open breaker never closes or re-opens
+        if is_available:
+            CIRCUIT_BREAKER.record_success()
+        else:
+            CIRCUIT_BREAKER.record_failure()
     if not response.ok:
         logger.error('TVmaze returned error {}'.format(response.status_code))
-    try:
-        response_text = pformat(response.json())
-    except ValueError:
-        response_text = response.text
-    logger.debug('API response:\n{}'.format(response_text))
+    response_bytes = int(response.headers.get('Content-Length') or len(response.content))
+    TRAFFIC_STATS.add(TrafficStats.get_endpoint(method, url),
+                      len(response.request.body or b''), response_bytes)
+    logger.debug('API response ({} bytes): {}'.format(response_bytes, _truncate(response.text)))
     return response
 
 
@@ -191,6 +410,8 @@ def start_authorization(email):
         response = _call_user_api(AUTH_START_PATH, 'post', authenticate=False, json=data)
     except requests.HTTPError as exc:
         raise AuthorizationError(response=exc.response)
+    except ServiceUnavailableError as exc:
+        raise AuthorizationError(exc.error_message)
     response_data = response.json()
     return response_data.get('token'), response_data.get('confirm_url')
 
@@ -209,6 +430,8 @@ def poll_authorization(token):
         if exc.response.status_code == 403:
             return None
         raise AuthorizationError(response=exc.response)
+    except ServiceUnavailableError as exc:
+        raise AuthorizationError(exc.error_message)
     response_data = response.json()
     return response_data.get('username'), response_data.get('apikey')
 
@@ -256,11 +479,15 @@ def get_show_info_by_external_id(show_id, provider):
     :raises TvMazeApiError: on any API error
     """
     params = {provider: show_id}
-    try:
-        response = _call_common_api(SHOW_LOOKUP_PATH, 'get', params=params)
-    except requests.HTTPError as exc:
-        raise TvMazeApiError(response=exc.response)
-    return response.json()
+
+    def lookup_show():
+        try:
+            response = _call_common_api(SHOW_LOOKUP_PATH, 'get', params=params)
+        except requests.HTTPError as exc:
+            raise TvMazeApiError(response=exc.response)
+        return response.json()
+
+    return SHOW_LOOKUP_CACHE.get_or_call((provider, show_id), lookup_show)
 
 
 def get_episodes_from_watchlist(tvmaze_id, type_=None):
@@ -277,8 +504,46 @@ def get_episodes_from_watchlist(tvmaze_id, type_=None):
     params = {'embed': 'episode'}
     if type_ is not None:
         params['type'] = type_
+
+    def get_watchlist():
+        try:
+            response = _call_user_api(path, 'get', authenticate=True, params=params)
+        except requests.HTTPError as exc:
+            raise TvMazeApiError(response=exc.response)
+        return response.json()
+
+    return WATCHLIST_CACHE.get_or_call((int(tvmaze_id), type_), get_watchlist)
+
+
+def get_show_info(tvmaze_id):
+    # type: (Union[int, Text]) -> DataType
+    """
+    Get show info from TVmaze
+
+    :param tvmaze_id: show ID on TVmaze
+    :return: show info from TVmaze
+    :raises TvMazeApiError: on any API error
+    """
+    path = '{}/{}'.format(SHOWS_PATH, tvmaze_id)
+    try:
+        response = _call_common_api(path, 'get')
+    except requests.HTTPError as exc:
+        raise TvMazeApiError(response=exc.response)
+    return response.json()
+
+
+def get_show_episodes(tvmaze_id):
+    # type: (Union[int, Text]) -> List[DataType]
+    """
+    Get the list of all episodes of a TV show including specials
+
+    :param tvmaze_id: show ID on TVmaze
+    :return: the list of episode infos from TVmaze
+    :raises TvMazeApiError: on any API error
+    """
+    path = '{}/{}/episodes'.format(SHOWS_PATH, tvmaze_id)
     try:
-        response = _call_user_api(path, 'get', authenticate=True, params=params)
+        response = _call_common_api(path, 'get', params={'specials': 1})
     except requests.HTTPError as exc:
         raise TvMazeApiError(response=exc.response)
     return response.json()
@@ -0,0 +1,135 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Listen to Kodi JSON-RPC notifications over WebSocket
+
+This is an alternative to :class:`xbmc.Monitor` for running outside Kodi.
+Requires Python 3.7+ and websockets package that is not needed
+by the addon itself, so it is imported only if available.
+"""
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from .kodi_service import logger
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+try:
+    # pylint: disable=unused-import
+    from typing import Text, Dict, Any
+    from .kodi_monitor import KodiMonitor
+except ImportError:
+    pass
+
+LIBRARY_METHODS = {
+    'VideoLibrary.OnUpdate',
+    'VideoLibrary.OnRemove',
+    'VideoLibrary.OnScanFinished',
+    'VideoLibrary.OnCleanFinished',
+}
+QUEUE_SIZE = 10000
+MIN_RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 60.0
+
+
+class NotificationListener:
+    """
+    Receive Kodi medialibrary notifications and pass them to a monitor
+
+    Notifications are read by a coroutine and queued.
+    Monitor handlers do blocking I/O so they are called one by one
+    in a single worker thread in the order of notifications.
+    The connection is re-established with exponential backoff if it is lost.
+    """
+
+    def __init__(self, url, monitor, queue_size=QUEUE_SIZE):
+        # type: (Text, KodiMonitor, int) -> None
+        """
+        :param url: Kodi WebSocket URL, e.g. ``ws://192.168.1.10:9090/jsonrpc``
+        :param monitor: an object with ``KodiMonitor`` notification handlers
+        :param queue_size: max number of notifications waiting to be handled
+        :raises RuntimeError: if websockets package is not installed
+        """
+        if websockets is None:
+            raise RuntimeError('websockets package is required to listen to notifications')
+        self._url = url
+        self._monitor = monitor
+        self._queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _handle(self, notification):
+        # type: (Dict[Text, Any]) -> None
+        method = notification['method']
+        params = notification.get('params') or {}
+        try:
+            if method == 'VideoLibrary.OnScanFinished':
+                self._monitor.onScanFinished('video')
+            elif method == 'VideoLibrary.OnCleanFinished':
+                self._monitor.onCleanFinished('video')
+            else:
+                self._monitor.onNotification(params.get('sender', 'xbmc'), method,
+                                             json.dumps(params.get('data')))
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.error('Failed to handle notification {}: {}'.format(method, exc))
+
+    async def _receive(self, queue):
+        # type: (asyncio.Queue) -> None
+        async with websockets.connect(self._url) as connection:
+            logger.info('Connected to {}'.format(self._url))
+            async for message in connection:
+                try:
+                    notification = json.loads(message)
+                except ValueError:
+                    logger.warning('Invalid notification message: {!r}'.format(message[:200]))
+                    continue
+                if not isinstance(notification, dict):
+                    continue
+                if notification.get('method') in LIBRARY_METHODS:
+                    await queue.put(notification)
+
+    async def _consume(self, queue):
+        # type: (asyncio.Queue) -> None
+        loop = asyncio.get_event_loop()
+        while True:
+            notification = await queue.get()
+            await loop.run_in_executor(self._executor, self._handle, notification)
+            queue.task_done()
+
+    async def run(self):
+        # type: () -> None
+        """Receive notifications until cancelled"""
+        queue = asyncio.Queue(maxsize=self._queue_size)
+        consumer = asyncio.ensure_future(self._consume(queue))
+        delay = MIN_RECONNECT_DELAY
+        try:
+            while True:
+                try:
+                    await self._receive(queue)
+                    delay = MIN_RECONNECT_DELAY
+                except (OSError, websockets.WebSocketException) as exc:
+                    logger.warning('Connection to {} failed: {}'.format(self._url, exc))
+                logger.info('Reconnecting in {:.0f}s'.format(delay))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        finally:
+            consumer.cancel()
+            self._executor.shutdown(wait=True)
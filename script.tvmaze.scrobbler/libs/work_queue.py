@@ -0,0 +1,164 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Run sync jobs in a background worker by priority
+
+All jobs are run one by one in a single worker thread so they never
+compete for TVmaze API. Higher priority jobs are always taken first.
+Long jobs call :func:`yield_to_higher_priority` between items
+(e.g. TV shows) to run waiting higher priority jobs inline,
+so the latency of interactive jobs is bounded by processing of one item.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import heapq
+import itertools
+import threading
+
+from .exception_logger import log_exception
+from .kodi_service import logger
+
+try:
+    from typing import Callable, List, Tuple, Any, Optional  # pylint: disable=unused-import
+except ImportError:
+    pass
+
+
+class Priority(object):  # pylint: disable=too-few-public-methods
+    INTERACTIVE = 0  # Single episodes watched by a user
+    POST_SCAN = 1  # Episodes changed by a library scan and recent episodes
+    BACKGROUND = 2  # Full sync and pulls
+
+
+class WorkQueue(object):
+    """Priority queue of jobs with a single worker thread"""
+
+    def __init__(self):
+        # type: () -> None
+        self._jobs = []  # type: List[Tuple[int, int, Callable[..., Any], tuple]]
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._worker = None  # type: Optional[threading.Thread]
+        self._stop_event = threading.Event()
+        self._local = threading.local()
+
+    def submit(self, priority, func, *args):
+        # type: (int, Callable[..., Any], *Any) -> None
+        """
+        Add a job to the queue
+
+        The worker thread is started on the first call.
+
+        :param priority: job priority (see :class:`Priority`)
+        :param func: job callable
+        :param args: job callable arguments
+        """
+        with self._condition:
+            heapq.heappush(self._jobs, (priority, next(self._counter), func, args))
+            if self._worker is None:
+                self._stop_event = threading.Event()
+                self._worker = threading.Thread(target=self._run, args=(self._stop_event,),
+                                                name='WorkQueue')
+                self._worker.daemon = True
+                self._worker.start()
+            self._condition.notify_all()
+
+    def _pop_job(self, max_priority):
+        # type: (int) -> Optional[Tuple[int, int, Callable[..., Any], tuple]]
+        with self._condition:
+            if self._jobs and self._jobs[0][0] <= max_priority:
+                return heapq.heappop(self._jobs)
+        return None
+
+    def _execute(self, job):
+        # type: (Tuple[int, int, Callable[..., Any], tuple]) -> None
+        priority, _, func, args = job
+        previous_priority = getattr(self._local, 'priority', None)
+        self._local.priority = priority
+        try:
+            with log_exception():
+                func(*args)
+        except Exception:  # pylint: disable=broad-except
+            pass  # Already logged, the worker must keep running
+        finally:
+            self._local.priority = previous_priority
+
+    def _run(self, stop_event):
+        # type: (threading.Event) -> None
+        while True:
+            with self._condition:
+                while not (self._jobs or stop_event.is_set()):
+                    self._condition.wait()
+                if stop_event.is_set():
+                    return
+                job = heapq.heappop(self._jobs)
+            self._execute(job)
+
+    def yield_to_higher_priority(self):
+        # type: () -> None
+        """
+        Run waiting jobs with higher priority than the current job
+
+        It does nothing if called outside the worker thread.
+        """
+        priority = getattr(self._local, 'priority', None)
+        if priority is None:
+            return
+        while True:
+            job = self._pop_job(priority - 1)
+            if job is None:
+                return
+            logger.debug('Running higher priority job {}'.format(job[2].__name__))
+            self._execute(job)
+
+    def stop(self, timeout=5.0):
+        # type: (float) -> None
+        """
+        Stop the worker thread after the current job
+
+        Waiting :attr:`Priority.INTERACTIVE` jobs are run in the calling thread
+        so that episodes watched just before Kodi exits are still pushed
+        (or deferred if TVmaze API is unavailable). Other waiting jobs are discarded
+        because they are repeated by scheduled tasks and syncs.
+        """
+        with self._condition:
+            worker = self._worker
+            self._worker = None
+            self._stop_event.set()
+            interactive_jobs = sorted(job for job in self._jobs
+                                      if job[0] <= Priority.INTERACTIVE)
+            del self._jobs[:]
+            self._condition.notify_all()
+        if worker is not None:
+            worker.join(timeout)
+        for job in interactive_jobs:
+            logger.debug('Running interactive job {} before stopping'.format(job[2].__name__))
+            self._execute(job)
+
+
+WORK_QUEUE = WorkQueue()
+
+
+def submit(priority, func, *args):
+    # type: (int, Callable[..., Any], *Any) -> None
+    WORK_QUEUE.submit(priority, func, *args)
+
+
+def yield_to_higher_priority():
+    # type: () -> None
+    WORK_QUEUE.yield_to_higher_priority()
@@ -21,10 +21,13 @@ from __future__ import absolute_import, unicode_literals
 from libs.exception_logger import log_exception
 from libs.kodi_monitor import KodiMonitor
 from libs.kodi_service import logger
-from libs.scheduled_tasks import periodic_pull
+from libs.scheduled_tasks import (TaskScheduler, PeriodicPullTask, EpisodeIdBackfillTask,
+                                  DeferredPushTask)
+from libs.work_queue import WORK_QUEUE
 
 with log_exception():
-    monitor = KodiMonitor()
-    while not monitor.waitForAbort(3.0):
-        periodic_pull()
+    scheduler = TaskScheduler([PeriodicPullTask(), EpisodeIdBackfillTask(), DeferredPushTask()])
+    monitor = KodiMonitor(on_settings_changed=scheduler.on_settings_changed)
+    scheduler.run(monitor)
+    WORK_QUEUE.stop()
     logger.info('Service stopped')
@@ -0,0 +1,127 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmark of Kodi API call overhead
+
+Compares JSON-RPC calls to a stub xbmc module made directly,
+through libs.kodi_compat and through KodiJsonRpcTransport with calls
+through a wrapper that converts strings the way kodi_six does on Python 2
+(the overhead that kodi_compat avoids) and through kodi_six itself
+if it is installed. Kodi is not needed.
+
+Example::
+
+    python tools/benchmark_kodi_compat.py --number 200000
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import six
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'script.tvmaze.scrobbler')
+sys.path.insert(0, ADDON_DIR)
+
+from libs import headless_runtime  # pylint: disable=wrong-import-position
+
+REQUEST = '{"jsonrpc": "2.0", "method": "JSONRPC.Ping", "id": "1"}'
+REPLY = '{"id": "1", "jsonrpc": "2.0", "result": "pong"}'
+
+
+def _execute_json_rpc(request):
+    # Python 2 Kodi API takes and returns byte strings
+    return REPLY.encode('utf-8') if isinstance(request, bytes) else REPLY
+
+
+def _wrap_function(func):
+    def wrapper(*args, **kwargs):
+        args = [arg.encode('utf-8') if isinstance(arg, six.text_type) else arg
+                for arg in args]
+        result = func(*args, **kwargs)
+        return result.decode('utf-8') if isinstance(result, bytes) else result
+    return wrapper
+
+
+class KodiSixStyleModule(object):  # pylint: disable=too-few-public-methods
+    """
+    Module wrapper that works like kodi_six on Python 2
+
+    Attributes are looked up via ``__getattr__`` and functions are wrapped
+    to encode unicode arguments and decode byte string results.
+    """
+
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, name):
+        attr = getattr(self._module, name)
+        return _wrap_function(attr) if callable(attr) else attr
+
+
+def _get_cases():
+    # pylint: disable=import-outside-toplevel
+    import xbmc
+    from libs import kodi_compat
+    from libs.medialibrary_api import KodiJsonRpcTransport
+
+    transport = KodiJsonRpcTransport()
+    wrapped_xbmc = KodiSixStyleModule(xbmc)
+    cases = [
+        ('native module', lambda: xbmc.executeJSONRPC(REQUEST)),
+        ('kodi_compat', lambda: kodi_compat.xbmc.executeJSONRPC(REQUEST)),
+        ('KodiJsonRpcTransport', lambda: transport.execute(REQUEST)),
+        ('kodi_six-style wrapper', lambda: wrapped_xbmc.executeJSONRPC(REQUEST)),
+    ]
+    try:
+        from kodi_six import xbmc as six_xbmc
+    except ImportError:
+        print('kodi_six is not installed, the kodi_six-style wrapper is the baseline')
+    else:
+        # On Python 3 kodi_six passes the native module through
+        cases.append(('kodi_six', lambda: six_xbmc.executeJSONRPC(REQUEST)))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Kodi API call overhead')
+    parser.add_argument('--number', type=int, default=100000,
+                        help='calls per measurement (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='measurements per case (default: %(default)s)')
+    args = parser.parse_args()
+    profile_dir = tempfile.mkdtemp()
+    try:
+        headless_runtime.install(profile_dir)
+        sys.modules['xbmc'].executeJSONRPC = _execute_json_rpc
+        print('Python {}.{}, {} calls'.format(sys.version_info[0], sys.version_info[1],
+                                             args.number))
+        for name, func in _get_cases():
+            best = min(timeit.repeat(func, number=args.number, repeat=args.repeat))
+            print('{:<24} {:8.1f} ns/call'.format(name, best / args.number * 1e9))
+    finally:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
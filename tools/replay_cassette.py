@@ -0,0 +1,111 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Replay a recorded cassette as a regression check
+
+Runs a sync command against a cassette in a fresh profile without TVmaze
+and Kodi. The check fails if the sync sends a request that has not been
+recorded or does not send a recorded one, e.g. skips an episode update.
+
+Record a cassette with the headless runner and replay it::
+
+    TVMAZE_APIKEY=XXXX python script.tvmaze.scrobbler/headless.py \\
+        --url http://192.168.1.10:8080/jsonrpc --tvmaze-user johndoe \\
+        --record sync.json sync
+    python tools/replay_cassette.py sync.json sync
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'script.tvmaze.scrobbler')
+sys.path.insert(0, ADDON_DIR)
+
+from libs import headless_runtime  # pylint: disable=wrong-import-position
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Replay a cassette as a regression check')
+    parser.add_argument('cassette', help='cassette file recorded with headless.py --record')
+    parser.add_argument('command', nargs='?', choices=['sync', 'pull'], default='sync',
+                        help='recorded sync command (default: %(default)s)')
+    parser.add_argument('--verbose', action='store_true', help='enable debug logging')
+    return parser.parse_args()
+
+
+def replay(cassette_path, command):
+    """
+    Run a sync command against a cassette
+
+    :return: the list of problems, empty if the replay matches the recording
+    """
+    # pylint: disable=import-outside-toplevel
+    from libs import medialibrary_api as medialib, scrobbling_service as scrobbler
+    from libs import tvmaze_api as tvmaze
+    from libs.cassettes import Cassette, CassetteAdapter, CassetteTransport
+    from libs.work_queue import WORK_QUEUE
+
+    cassette = Cassette(cassette_path)
+    cassette.load()
+    adapter = CassetteAdapter(cassette, replay=True)
+    tvmaze.SESSION.mount('http://', adapter)
+    tvmaze.SESSION.mount('https://', adapter)
+    medialib.set_transport(CassetteTransport(cassette))
+    started_at = time.time()
+    try:
+        if command == 'sync':
+            scrobbler.sync_all_episodes()
+        else:
+            scrobbler.pull_watched_episodes()
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.exception('Replay failed')
+        return ['{}: {}'.format(type(exc).__name__, exc)]
+    finally:
+        WORK_QUEUE.stop()
+    logging.info('Replayed "%s" in %.2fs', command, time.time() - started_at)
+    problems = ['Not recorded: {} {}'.format(*key) for key in cassette.missed]
+    problems.extend('Not replayed: {} {}'.format(*key) for key in cassette.get_unplayed())
+    return problems
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    profile_dir = tempfile.mkdtemp()
+    try:
+        # Credentials are not recorded, any non-empty values pass authorization checks
+        headless_runtime.install(profile_dir, {'username': 'replay', 'apikey': 'replay'})
+        problems = replay(args.cassette, args.command)
+    finally:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+    for problem in problems:
+        print(problem)
+    print('FAIL' if problems else 'OK')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,325 @@
+# coding: utf-8
+# (c) Roman Miroshnychenko <roman1972@gmail.com> 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Stress test of Kodi medialibrary notification handling
+
+Fires bursts of VideoLibrary.OnUpdate notifications through KodiMonitor
+in the headless runtime with in-process fake Kodi and TVmaze backends
+and reports handler latency, throughput, dropped episodes and the number
+of JSON-RPC and TVmaze API requests.
+
+The check fails if any burst is handled slower than the target rate
+(KodiMonitor must sustain 5000 episode updates per second)
+or if any notified episode is not pushed or journaled.
+
+Example::
+
+    python tools/stress_kodi_monitor.py --bursts 5 --burst-size 20000
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'script.tvmaze.scrobbler')
+sys.path.insert(0, ADDON_DIR)
+
+# pylint: disable=wrong-import-position
+import requests
+from requests.adapters import BaseAdapter
+
+from libs import headless_runtime
+
+clock = getattr(time, 'perf_counter', time.time)  # pylint: disable=invalid-name
+
+
+class FakeKodiTransport(object):
+    """In-process Kodi JSON-RPC backend with a library of numbered episodes"""
+
+    def __init__(self, show_count, latency):
+        # type: (int, float) -> None
+        self.show_count = show_count
+        self.latency = latency
+        self.request_count = 0
+        self.method_counts = Counter()
+        self.fetched_episode_ids = set()
+        self._lock = threading.Lock()
+
+    def _get_episode(self, episode_id):
+        return {
+            'episodeid': episode_id,
+            'tvshowid': episode_id % self.show_count + 1,
+            'season': 1,
+            'episode': episode_id,
+            'playcount': 1,
+            'uniqueid': {},
+            'dateadded': '2020-01-01 00:00:00',
+            'lastplayed': '2020-01-02 00:00:00',
+            'firstaired': '2020-01-01',
+            'label': 'Episode {}'.format(episode_id),
+        }
+
+    def _get_tvshow(self, tvshow_id):
+        return {'tvshowid': tvshow_id, 'label': 'Show {}'.format(tvshow_id),
+                'uniqueid': {'tvmaze': str(tvshow_id)}, 'episode': 0, 'watchedepisodes': 0}
+
+    def _call(self, call):
+        method = call['method']
+        params = call.get('params') or {}
+        with self._lock:
+            self.method_counts[method] += 1
+            if method == 'VideoLibrary.GetEpisodeDetails':
+                self.fetched_episode_ids.add(params['episodeid'])
+        if method == 'VideoLibrary.GetEpisodeDetails':
+            result = {'episodedetails': self._get_episode(params['episodeid'])}
+        elif method == 'VideoLibrary.GetTVShowDetails':
+            result = {'tvshowdetails': self._get_tvshow(params['tvshowid'])}
+        elif method == 'VideoLibrary.GetTVShows':
+            tvshows = [self._get_tvshow(tvshow_id) for tvshow_id in range(1, self.show_count + 1)]
+            result = {'tvshows': tvshows,
+                      'limits': {'start': 0, 'end': len(tvshows), 'total': len(tvshows)}}
+        else:
+            result = 'OK'
+        return {'jsonrpc': '2.0', 'id': call.get('id'), 'result': result}
+
+    def execute(self, request):
+        with self._lock:
+            self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        calls = json.loads(request)
+        if isinstance(calls, list):
+            return json.dumps([self._call(call) for call in calls])
+        return json.dumps(self._call(calls))
+
+
+class FakeTvmazeAdapter(BaseAdapter):
+    """Requests transport adapter that accepts all TVmaze API requests"""
+
+    def __init__(self, latency):
+        # type: (float) -> None
+        super(FakeTvmazeAdapter, self).__init__()
+        self.latency = latency
+        self.request_counts = Counter()
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        with self._lock:
+            self.request_counts['{} {}'.format(request.method,
+                                               request.path_url.split('?')[0])] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response._content = b'[]'  # pylint: disable=protected-access
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Stress test Kodi notification handling')
+    parser.add_argument('--bursts', type=int, default=3,
+                        help='number of notification bursts (default: %(default)s)')
+    parser.add_argument('--burst-size', type=int, default=10000,
+                        help='notifications per burst (default: %(default)s)')
+    parser.add_argument('--changed-ratio', type=float, default=0.2,
+                        help='share of episode updates without playcount changes '
+                             '(default: %(default)s)')
+    parser.add_argument('--shows', type=int, default=20,
+                        help='number of TV shows in the fake library (default: %(default)s)')
+    parser.add_argument('--kodi-latency', type=float, default=0.005,
+                        help='simulated JSON-RPC latency in seconds (default: %(default)s)')
+    parser.add_argument('--tvmaze-latency', type=float, default=0.05,
+                        help='simulated TVmaze API latency in seconds (default: %(default)s)')
+    parser.add_argument('--target-rate', type=float, default=5000.0,
+                        help='min notifications per second in a burst (default: %(default)s)')
+    parser.add_argument('--drain-timeout', type=float, default=300.0,
+                        help='max seconds to wait for background jobs after a burst '
+                             '(default: %(default)s)')
+    return parser.parse_args()
+
+
+def _percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100.0))
+    return sorted_values[index]
+
+
+def _wait_for_jobs(timeout):
+    """Wait until the work queue has run all jobs that were submitted so far"""
+    # pylint: disable=import-outside-toplevel
+    from libs.work_queue import Priority, submit
+
+    done = threading.Event()
+    # Background priority jobs are run after all notification jobs
+    submit(Priority.BACKGROUND, done.set)
+    return done.wait(timeout)
+
+
+def fire_burst(monitor, first_episode_id, args):
+    """
+    Send a burst of notifications
+
+    :return: (handler latencies, elapsed seconds, watched episode IDs,
+        changed episode IDs) tuple
+    """
+    latencies = []
+    watched_ids = []
+    changed_ids = []
+    started_at = clock()
+    for index in range(args.burst_size):
+        episode_id = first_episode_id + index
+        if int((index + 1) * args.changed_ratio) > int(index * args.changed_ratio):
+            data = json.dumps({'item': {'id': episode_id, 'type': 'episode'}})
+            changed_ids.append(episode_id)
+        else:
+            data = json.dumps({'item': {'id': episode_id, 'type': 'episode'}, 'playcount': 1})
+            watched_ids.append(episode_id)
+        call_started_at = clock()
+        monitor.onNotification('xbmc', 'VideoLibrary.OnUpdate', data)
+        latencies.append(clock() - call_started_at)
+    return latencies, clock() - started_at, watched_ids, changed_ids
+
+
+def _report_burst(burst, latencies, elapsed, drain_time, args):
+    """
+    Print burst statistics
+
+    :return: failed check or ``None``
+    """
+    rate = args.burst_size / elapsed
+    latencies = sorted(latencies)
+    print('Burst {}: {:.0f} notifications/s, latency p50 {:.1f}us p95 {:.1f}us '
+          'p99 {:.1f}us max {:.1f}us, jobs done in {:.2f}s'.format(
+              burst, rate, _percentile(latencies, 50) * 1e6, _percentile(latencies, 95) * 1e6,
+              _percentile(latencies, 99) * 1e6, latencies[-1] * 1e6, drain_time))
+    if rate < args.target_rate:
+        return 'Burst {}: {:.0f} notifications/s is below the target {:.0f}/s'.format(
+            burst, rate, args.target_rate)
+    return None
+
+
+def _report_totals(kodi_backend, tvmaze_backend, watched_ids, changed_ids):
+    """
+    Print dropped episodes and backend request counts
+
+    :return: failed check or ``None``
+    """
+    # pylint: disable=import-outside-toplevel
+    from libs.library_journal_db import LibraryJournalDb
+
+    with LibraryJournalDb() as database:
+        journaled_ids = set(database.get_dirty_episodes(len(changed_ids) + 1))
+    dropped_watched = watched_ids - kodi_backend.fetched_episode_ids
+    dropped_changed = changed_ids - journaled_ids
+    print('Notifications: {} watched, {} changed'.format(len(watched_ids), len(changed_ids)))
+    print('Dropped: {} watched, {} changed'.format(len(dropped_watched), len(dropped_changed)))
+    print('Kodi JSON-RPC: {} HTTP requests, {} calls'.format(
+        kodi_backend.request_count, sum(kodi_backend.method_counts.values())))
+    for method, count in sorted(kodi_backend.method_counts.items()):
+        print('    {}: {}'.format(method, count))
+    print('TVmaze API: {} HTTP requests'.format(sum(tvmaze_backend.request_counts.values())))
+    for request, count in sorted(tvmaze_backend.request_counts.items()):
+        print('    {}: {}'.format(request, count))
+    if dropped_watched or dropped_changed:
+        return '{} episodes are dropped'.format(len(dropped_watched) + len(dropped_changed))
+    return None
+
+
+def _install_backends(args):
+    """
+    Replace Kodi JSON-RPC transport and TVmaze API transport adapter with fakes
+
+    :return: (Kodi backend, TVmaze backend) tuple
+    """
+    # pylint: disable=import-outside-toplevel
+    from libs import medialibrary_api as medialib, tvmaze_api as tvmaze
+
+    kodi_backend = FakeKodiTransport(args.shows, args.kodi_latency)
+    tvmaze_backend = FakeTvmazeAdapter(args.tvmaze_latency)
+    medialib.set_transport(kodi_backend)
+    tvmaze.SESSION.mount('http://', tvmaze_backend)
+    tvmaze.SESSION.mount('https://', tvmaze_backend)
+    return kodi_backend, tvmaze_backend
+
+
+def run(args):
+    """
+    Run notification bursts
+
+    :return: the list of failed checks
+    """
+    # pylint: disable=import-outside-toplevel
+    from libs.kodi_monitor import KodiMonitor
+    from libs.work_queue import WORK_QUEUE
+
+    kodi_backend, tvmaze_backend = _install_backends(args)
+    monitor = KodiMonitor()
+    failures = []
+    all_watched_ids = set()
+    all_changed_ids = set()
+    try:
+        for burst in range(1, args.bursts + 1):
+            latencies, elapsed, watched_ids, changed_ids = fire_burst(
+                monitor, (burst - 1) * args.burst_size + 1, args)
+            all_watched_ids.update(watched_ids)
+            all_changed_ids.update(changed_ids)
+            drain_started_at = clock()
+            if not _wait_for_jobs(args.drain_timeout):
+                failures.append('Burst {}: jobs are not done in {}s'.format(
+                    burst, args.drain_timeout))
+            failures.append(_report_burst(burst, latencies, elapsed,
+                                          clock() - drain_started_at, args))
+    finally:
+        WORK_QUEUE.stop()
+    failures.append(_report_totals(kodi_backend, tvmaze_backend,
+                                   all_watched_ids, all_changed_ids))
+    return [failure for failure in failures if failure is not None]
+
+
+def main():
+    args = parse_arguments()
+    profile_dir = tempfile.mkdtemp()
+    try:
+        # Episode updates without playcount changes are journaled only with sync on update
+        headless_runtime.install(profile_dir, {'username': 'stress', 'apikey': 'stress',
+                                               'sync_on_update': 'true'})
+        failures = run(args)
+    finally:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+    for failure in failures:
+        print(failure)
+    print('FAIL' if failures else 'OK')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())